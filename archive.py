@@ -0,0 +1,74 @@
+"""Test programs read straight from tar and zip archives.
+
+The .py members of an archive are the programs; a member t.in next to
+t.py is its stdin. Nothing is extracted into the tree: programs are fed
+to the parser from memory, and python3 runs each from a temporary file.
+Member names are normalised, so ./t.py is reported as t.py. Zip members
+are read on demand. A compressed tar cannot seek back without
+decompressing again from the start, so its programs and .in files are
+read in archive order, in one streaming pass, when the archive is
+opened.
+"""
+
+import os
+import posixpath
+import tarfile
+import zipfile
+
+
+def is_archive(path):
+    """Whether `path` is a tar (possibly compressed) or zip file."""
+    if not os.path.isfile(path) or path.endswith('.py'):
+        return False
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+class Archive(object):
+    """The members of an archive. Programs are named by the archive
+    path joined with the member name, e.g. subs.tar.gz/hw1/t.py."""
+
+    def __init__(self, path):
+        self.path = path
+        if zipfile.is_zipfile(path):
+            self.zip = zipfile.ZipFile(path)
+            self.tar = None
+            self.members = {posixpath.normpath(info.filename): info
+                            for info in self.zip.infolist()
+                            if not info.is_dir()}
+        else:
+            self.zip = None
+            # name -> data of the .py and .in members, in archive order
+            self.members = {}
+            with tarfile.open(path, 'r|*') as tar:
+                for member in tar:
+                    if member.isfile() and \
+                            member.name.endswith(('.py', '.in')):
+                        with tar.extractfile(member) as f:
+                            name = posixpath.normpath(member.name)
+                            self.members[name] = f.read()
+
+    def programs(self):
+        """Names of the programs, sorted like val.discover."""
+        return sorted(os.path.join(self.path, name)
+                      for name in self.members if name.endswith('.py'))
+
+    def member(self, program):
+        return program[len(os.path.join(self.path, '')):]
+
+    def read(self, name):
+        if self.zip is not None:
+            data = self.zip.read(self.members[name])
+        else:
+            data = self.members[name]
+        return data.decode()
+
+    def source(self, program):
+        """(code, stdin) of a program; stdin is None without a .in."""
+        name = self.member(program)
+        companion = os.path.splitext(name)[0] + '.in'
+        indata = self.read(companion) if companion in self.members else None
+        return self.read(name), indata
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
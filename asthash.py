@@ -0,0 +1,168 @@
+"""Structural hashing and comparison of ASTs, and a corpus checker
+that compares the trees built by the ply front end (Parser) with the
+ones built by ast.parse.
+
+Positions are ignored and expression contexts (Load/Store) are not
+compared. A field that is missing, None or an empty list counts as
+empty, since the ply actions leave optional fields unset.
+
+Usage: python3 asthash.py --subset=<python-subset> \
+                          --input=<file|dir|archive> \
+                          [--verbose]
+
+Example: python3 asthash.py --subset=P3 --input=tests/
+"""
+
+import argparse
+import ast
+import hashlib
+from val import *
+
+# fields that never take part in the structure
+ignored_fields = {'ctx', 'type_comment', 'kind'}
+
+
+def normalize(value):
+    if value is None or (isinstance(value, list) and not value):
+        return None
+    return value
+
+
+# fields holding the name of a variable, function or parameter
+identifier_fields = {'id', 'name', 'arg'}
+
+
+def bound_names(tree):
+    """Names the program binds: assignment targets,
+    function names and parameters."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, Name) and isinstance(getattr(node, 'ctx', None),
+                                                 Store):
+            names.add(node.id)
+        elif isinstance(node, FunctionDef):
+            names.add(node.name)
+        elif isinstance(node, arg):
+            names.add(node.arg)
+    return names
+
+
+def ast_hash(tree, rename=False, abstract_constants=False):
+    """Hash the structure of `tree` in one iterative pre-order
+    pass, feeding the digest as the nodes are visited.
+
+    With `rename`, the names the program binds are replaced by their
+    order of first appearance, so the hash does not depend on how
+    variables are named (builtins such as print keep their name). With
+    `abstract_constants`, only the type of a constant is hashed."""
+    digest = hashlib.blake2b(digest_size=16)
+    update = digest.update
+    bound = bound_names(tree) if rename else ()
+    renamed = {}
+    stack = [tree]
+    while stack:
+        item = normalize(stack.pop())
+        if isinstance(item, AST):
+            update(b'(' + type(item).__name__.encode())
+            if abstract_constants and isinstance(item, Constant):
+                update(type(item.value).__name__.encode())
+                continue
+            for field in reversed(item._fields):
+                if field in ignored_fields:
+                    continue
+                value = getattr(item, field, None)
+                if field in identifier_fields and value in bound:
+                    value = renamed.setdefault(value, len(renamed))
+                stack.append(value)
+        elif isinstance(item, list):
+            update('[{}'.format(len(item)).encode())
+            stack.extend(reversed(item))
+        elif item is None:
+            update(b'_')
+        else:
+            update('<{}:{!r}'.format(type(item).__name__, item).encode())
+    return digest.hexdigest()
+
+
+def describe(value):
+    if isinstance(value, AST):
+        return type(value).__name__
+    if isinstance(value, list):
+        return 'list of {}'.format(len(value))
+    return '{}({!r})'.format(type(value).__name__, value)
+
+
+def ast_diff(a, b):
+    """Compare two trees structurally. Returns None when they match,
+    otherwise (path, what a has, what b has) for the first difference."""
+    stack = [('', a, b)]
+    while stack:
+        path, x, y = stack.pop()
+        x, y = normalize(x), normalize(y)
+        if type(x) is not type(y):
+            return path or '.', describe(x), describe(y)
+        if isinstance(x, AST):
+            for field in reversed(x._fields):
+                if field not in ignored_fields:
+                    stack.append(('{}.{}'.format(path, field),
+                                  getattr(x, field, None),
+                                  getattr(y, field, None)))
+        elif isinstance(x, list):
+            if len(x) != len(y):
+                return path, describe(x), describe(y)
+            for i in reversed(range(len(x))):
+                stack.append(('{}[{}]'.format(path, i), x[i], y[i]))
+        elif x != y:
+            return path, describe(x), describe(y)
+    return None
+
+
+def check_file(subset, file, parser, source=None):
+    """Compare the ply tree of `file` with the one from ast.parse.
+    Returns None when they match, else a description of the mismatch.
+    `source` is the (code, stdin) of the file, if already read."""
+    code, _ = source or read_source(file)
+    try:
+        ply_tree = parse_source(subset, code, parser)
+    except ValidationError as e:
+        return 'rejected by ply: {}'.format(e)
+    py_tree = ast.parse(code)
+    if ast_hash(ply_tree) == ast_hash(py_tree):
+        return None
+    path, ply_has, py_has = ast_diff(ply_tree, py_tree)
+    return 'at {}: ply has {}, ast.parse has {}'.format(path, ply_has, py_has)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the ply AST with ast.parse")
+    parser.add_argument(
+        "--subset", help="python subset to parse with", required=True)
+    parser.add_argument(
+        "--input", help="input file(s) to check: a file, a directory"
+        " or a tar/zip archive", required=True)
+    parser.add_argument(
+        "--verbose", help="print verbose output", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not is_valid_subset(args.subset):
+        exit(1)
+    files, source = open_programs(args.input)
+    parser = Parser(args.subset)
+    mismatches = 0
+    for file in files:
+        mismatch = check_file(args.subset, file, parser, source(file))
+        if mismatch:
+            mismatches += 1
+            print('{}: {}'.format(file, mismatch))
+        elif args.verbose:
+            print('{}: ok'.format(file))
+    print('{} of {} files differ'.format(mismatches, len(files)))
+    exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
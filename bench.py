@@ -0,0 +1,591 @@
+"""Benchmarks and stress runs for the validator.
+
+Usage: python3 bench.py threads [--threads=<n>] [--iterations=<n>]
+       python3 bench.py daemon [--requests=<n>] [--workers=<n>]
+       python3 bench.py tokens [--depth=<n>] [--repeat=<n>]
+       python3 bench.py incremental [--functions=<n>] [--input=<dir>]
+       python3 bench.py corpus [--files=<n>] [--jobs=<n>] [--stages=<list>]
+       python3 bench.py interp [--input=<dir>]
+       python3 bench.py gate [--input=<dir>] [--subset=<subset>] \
+                             [--baseline=<file>] [--save] \
+                             [--samples=<n>] [--threshold=<fraction>]
+
+Example: python3 bench.py threads --threads=16
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import ast
+import gc
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from val import *
+
+# one small program per subset, each using
+# the constructs the subset adds
+samples = {
+    'p0': "x = 1\n"
+          "y = -x + 2\n"
+          "print(x + y)\n",
+    'p1': "a = [1, 2, 3]\n"
+          "d = {1: True, 2: False}\n"
+          "print(a[0] + a[1] if d[1] and not d[2] else a == [1])\n"
+          "print(a is a, 1 != 2)\n",
+    'p2': "def f(x, y):\n"
+          "    return x + y\n"
+          "g = lambda z: z + 1\n"
+          "print(f(1, g(2)))\n",
+    'p3': "i = 0\n"
+          "while i != 10:\n"
+          "    i = i + 1\n"
+          "    if i == 5:\n"
+          "        print(i)\n"
+          "    else:\n"
+          "        print(-i)\n"
+          "print(i)\n",
+}
+
+
+def parse_sample(subset, parser=None):
+    if parser is None:
+        parser = Parser(subset)
+    lexer = IndentWrapper(Lexer())
+    return parser.parse(samples[subset] + '\n', lexer=lexer, subset=subset)
+
+
+def gil_state():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    if is_gil_enabled is None:
+        return 'GIL'
+    return 'GIL' if is_gil_enabled() else 'free-threaded'
+
+
+def parse_concurrently(threads, iterations, expected):
+    """Build and use P0-P3 parsers from `threads` threads at once,
+    checking every tree against the ast.dump in `expected`. Returns
+    the number of parses; raises AssertionError on a differing tree."""
+    def worker(n):
+        subset = subset_tbl[n % len(subset_tbl)]
+        for _ in range(iterations):
+            tree = parse_sample(subset)
+            if ast.dump(tree) != expected[subset]:
+                raise AssertionError(
+                    "thread {}: {} tree differs".format(n, subset))
+        return iterations
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return sum(pool.map(worker, range(threads)))
+
+
+def check_threads(threads=4, iterations=20):
+    """Short run of parse_concurrently, for the gate. Returns whether
+    every tree matched."""
+    expected = {subset: ast.dump(parse_sample(subset)) for subset in samples}
+    try:
+        parse_concurrently(threads, iterations, expected)
+    except AssertionError as e:
+        print("concurrent parse: {}".format(e))
+        return False
+    return True
+
+
+def bench_threads(max_threads, iterations):
+    """Build and use P0-P3 parsers concurrently from 1, 2, 4 ...
+    max_threads threads. Every tree is checked against one built
+    single-threaded, so any cross-talk between parsers fails the run.
+    Parses only scale with threads on a free-threaded build."""
+    expected = {subset: ast.dump(parse_sample(subset)) for subset in samples}
+    print("{} {}".format(sys.version.split()[0], gil_state()))
+    if gil_state() == 'GIL':
+        print("threads share the GIL: expect no speedup, the run only"
+              " checks the trees")
+    base = None
+    threads = 1
+    while threads <= max_threads:
+        start = time.perf_counter()
+        try:
+            parses = parse_concurrently(threads, iterations, expected)
+        except AssertionError as e:
+            print("threads={}: {}".format(threads, e))
+            exit(1)
+        rate = parses / (time.perf_counter() - start)
+        base = base or rate
+        print("threads={:<4} parses/s={:<10.0f} speedup={:.2f}"
+              .format(threads, rate, rate / base))
+        threads *= 2
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def bench_daemon(requests, workers):
+    """Send the samples to an in-process daemon over its Unix socket
+    and report requests/s and latency, with and without execution."""
+    from daemon import Client, Server, Validator
+    validator = Validator(workers)
+    path = os.path.join(tempfile.mkdtemp(), 'val.sock')
+    server = Server(path, validator)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with Client(path) as client:
+            for execute in (False, True):
+                latencies = []
+                start = time.perf_counter()
+                for n in range(requests):
+                    subset = subset_tbl[n % len(subset_tbl)]
+                    sent = time.perf_counter()
+                    verdict = client.validate(id=n, source=samples[subset],
+                                              subset=subset, exec=execute)
+                    latencies.append(time.perf_counter() - sent)
+                    if not verdict['valid']:
+                        raise AssertionError(verdict)
+                rate = requests / (time.perf_counter() - start)
+                print("exec={:<5} requests/s={:<8.0f} p50={:.2f}ms p99={:.2f}ms"
+                      .format(str(execute), rate,
+                              percentile(latencies, 0.5) * 1000,
+                              percentile(latencies, 0.99) * 1000))
+    finally:
+        server.shutdown()
+        server.server_close()
+        validator.close()
+
+
+def nested_program(depth, repeat):
+    """A P3 program of `repeat` blocks, each nesting
+    while/if statements `depth` levels deep."""
+    lines = []
+    for n in range(repeat):
+        lines.append("x = {}".format(n))
+        for level in range(depth):
+            keyword = "while" if level % 2 else "if"
+            lines.append("    " * level + "{} x == {}:".format(keyword, level))
+            lines.append("    " * (level + 1) + "x = x + 1")
+        lines.append("print(x)")
+    return "\n".join(lines) + "\n\n"
+
+
+def bench_tokens(depth, repeat):
+    """Token throughput of Lexer + IndentWrapper on a deeply indented
+    program, and the memory the token list retains (tracemalloc)."""
+    code = nested_program(depth, repeat)
+    tokenize(code)
+    start = time.perf_counter()
+    count = len(tokenize(code))
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tokens = tokenize(code)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    print("tokens={} tokens/s={:.0f} bytes/token={:.1f} peak bytes/token={:.1f}"
+          .format(count, count / elapsed, retained / len(tokens),
+                  peak / len(tokens)))
+
+
+def stress_program(functions):
+    """A P3 program of `functions` functions, each called once."""
+    lines = []
+    for n in range(functions):
+        lines += ["def f{}(x):".format(n),
+                  "    i = 0",
+                  "    while i != x:",
+                  "        if i == {}:".format(n % 7),
+                  "            print(i)",
+                  "        i = i + 1",
+                  "    return i + {}".format(n),
+                  "print(f{}({}))".format(n, n % 5)]
+    return "\n".join(lines) + "\n"
+
+
+def bench_incremental(functions, corpus=None):
+    """Reparse time of a large program after editing one function,
+    in full and with an IncrementalParser. Then checks the two parses
+    agree on the samples and the programs in `corpus`."""
+    code = stress_program(functions)
+    edited = code.replace("return i + {}\n".format(functions // 2),
+                          "return i + {} + 1\n".format(functions // 2))
+    parser = Parser('p3')
+    incremental = IncrementalParser()
+    parse_source('p3', code, incremental)
+    start = time.perf_counter()
+    full = parse_source('p3', edited, parser)
+    full_time = time.perf_counter() - start
+    start = time.perf_counter()
+    tree = parse_source('p3', edited, incremental)
+    incremental_time = time.perf_counter() - start
+    assert ast.dump(tree) == ast.dump(full)
+    print("lines={} full={:.1f}ms incremental={:.2f}ms chunks parsed={}"
+          " reused={}".format(code.count("\n"), full_time * 1000,
+                              incremental_time * 1000, incremental.parsed,
+                              incremental.reused))
+    programs = [(subset, sample) for subset, sample in samples.items()]
+    programs.append(('stress', stress_program(20)))
+    for file in discover(corpus) if corpus else []:
+        with open(file, 'r') as f:
+            programs.append((file, f.read()))
+    if check_incremental(programs):
+        exit(1)
+
+
+def parse_verdict(code, subset, parser):
+    """ast.dump of the tree of `code`, or None if it is rejected."""
+    try:
+        return ast.dump(parse_source(subset, code, parser))
+    except ValidationError:
+        return None
+
+
+def edge_variants(code):
+    """`code` with blank and comment lines where chunks begin and end."""
+    return [code, '# c\n' + code, '\n' + code, '  \n' + code,
+            code + '\n# c\n', code + '\n\n', code.rstrip('\n'),
+            code.replace('\n', '\n\n'), code.replace('\n', '  # c\n')]
+
+
+def check_incremental(programs):
+    """Check that an IncrementalParser accepts and rejects exactly what
+    a full parse does, with the same trees, on every program and its
+    edge_variants at every subset. Returns the number of mismatches."""
+    parser = Parser()
+    incremental = IncrementalParser()
+    mismatches = checked = 0
+    for name, code in programs:
+        for variant in edge_variants(code) + ['', '\n', '# c\n']:
+            for subset in subset_tbl:
+                checked += 1
+                full = parse_verdict(variant, subset, parser)
+                if parse_verdict(variant, subset, incremental) != full:
+                    mismatches += 1
+                    print("{} ({}): incremental parse {} {!r}".format(
+                        name, subset, "rejects" if full else "accepts",
+                        variant[:40]))
+    print("checked={} mismatches={}".format(checked, mismatches))
+    return mismatches
+
+
+def exception_name(error):
+    """Name of the exception on the last line of a traceback."""
+    if not error:
+        return None
+    return error.strip().splitlines()[-1].split(':')[0]
+
+
+def bench_interp(corpus):
+    """Run the programs in `corpus` in the built-in interpreter and under
+    python3, and check that both agree on success, stdout and the
+    exception raised. Exits 1 on any disagreement."""
+    parser = Parser()
+    native_time = python_time = 0.0
+    mismatches = 0
+    files = discover(corpus)
+    for file in files:
+        with open(file, 'r') as f:
+            code = f.read()
+        indata = read_input(file)
+        start = time.perf_counter()
+        native = interp.run(parse_source('p3', code, parser), indata)
+        native_time += time.perf_counter() - start
+        start = time.perf_counter()
+        python = run_python(code, indata)
+        python_time += time.perf_counter() - start
+        if native[:2] != python[:2] or \
+                exception_name(native[2]) != exception_name(python[2]):
+            mismatches += 1
+            print("{}: interpreter differs from {}:\n"
+                  " interpreter: ok={} stdout={!r} error={!r}\n"
+                  " {}: ok={} stdout={!r} error={!r}"
+                  .format(file, python_exe, *native, python_exe, *python))
+    print("programs={} mismatches={} interpreter={:.1f}ms {}={:.1f}ms".format(
+        len(files), mismatches, native_time * 1000, python_exe,
+        python_time * 1000))
+    if mismatches:
+        exit(1)
+
+
+def bench_corpus(files, jobs, stages):
+    """End-to-end files/s of run_files on a corpus of many small files,
+    with workers reading their files and with a SharedCorpus."""
+    # a single job validates in-process, without workers to share with
+    jobs = jobs or max(os.cpu_count(), 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in range(files):
+            subset = subset_tbl[n % len(subset_tbl)]
+            path = os.path.join(tmp, 't{}_{}.py'.format(n, subset))
+            with open(path, 'w') as f:
+                f.write(samples[subset])
+            if n % 2:
+                with open(os.path.splitext(path)[0] + '.in', 'w') as f:
+                    f.write('{}\n'.format(n))
+        programs = discover(tmp)
+        for shared in (False, True):
+            start = time.perf_counter()
+            results = list(run_files('p3', programs, 'native', jobs, stages,
+                                     shared=shared))
+            elapsed = time.perf_counter() - start
+            assert all(result['valid'] for result in results)
+            print("shared={:<5} jobs={} files={} files/s={:.0f}".format(
+                str(shared), jobs, files, files / elapsed))
+
+
+# stages timed by the regression gate; exec runs the built-in
+# interpreter, which is deterministic enough to time
+gate_stages = ('lex', 'parse', 'nodes', 'exec')
+# seconds a gate sample runs at least; small workloads are repeated
+# within a sample until they take this long
+gate_sample_time = 0.1
+# a stage must lose at least this many seconds over a sample to regress;
+# smaller differences are timer and scheduler noise
+gate_floor = 0.005
+
+
+def gate_workloads(corpus=None, subset='p3'):
+    """The programs of each gate workload, as (subset, code, stdin):
+    the samples, generated stress programs and, optionally, the
+    programs of a corpus directory."""
+    workloads = {
+        'samples': [(name, samples[name], None) for name in subset_tbl],
+        'nested': [('p3', nested_program(20, 50), None)],
+        'functions': [('p3', stress_program(300), None)],
+    }
+    if corpus:
+        programs = []
+        for file in discover(corpus):
+            with open(file, 'r') as f:
+                programs.append((subset, f.read(), read_input(file)))
+        workloads['corpus'] = programs
+    return workloads
+
+
+def time_stages(programs, parser):
+    """Seconds spent in each gate stage over `programs`. A program
+    failing a stage skips the stages after it. One Lexer lexes every
+    program, so that lex times the rules rather than building it."""
+    times = dict.fromkeys(gate_stages, 0.0)
+    lexer = Lexer()
+    for subset, code, indata in programs:
+        try:
+            start = time.perf_counter()
+            tokens = tokenize(code + '\n', lexer)
+            times['lex'] += time.perf_counter() - start
+            start = time.perf_counter()
+            tree = parser.parse(code, TokenReplay(tokens), subset)
+            times['parse'] += time.perf_counter() - start
+        except ValidationError:
+            continue
+        start = time.perf_counter()
+        valid = dispatch_tbl[subset](code)
+        times['nodes'] += time.perf_counter() - start
+        if not valid:
+            continue
+        start = time.perf_counter()
+        interp.run(tree, indata)
+        times['exec'] += time.perf_counter() - start
+    return times
+
+
+def time_sample(programs, parser, rounds):
+    """Seconds per source line spent in each gate stage, over `rounds`
+    runs of `programs`. Like timeit, the garbage collector is off while
+    timing, so its pauses do not land in random stages."""
+    times = dict.fromkeys(gate_stages, 0.0)
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            for stage, seconds in time_stages(programs, parser).items():
+                times[stage] += seconds
+    finally:
+        gc.enable()
+    lines = sum(code.count('\n') for _, code, _ in programs) or 1
+    return {stage: seconds / (rounds * lines)
+            for stage, seconds in times.items()}
+
+
+def measure_workloads(workloads, repeat):
+    """Median and samples of the time per line of every stage of every
+    workload. Each sample repeats the workload `rounds` times, so that
+    it runs for at least gate_sample_time."""
+    parser = Parser('p3')
+    measured = {}
+    for name, programs in sorted(workloads.items()):
+        start = time.perf_counter()
+        time_stages(programs, parser)  # warm up
+        once = max(time.perf_counter() - start, 1e-6)
+        rounds = math.ceil(gate_sample_time / once)
+        runs = [time_sample(programs, parser, rounds) for _ in range(repeat)]
+        lines = sum(code.count('\n') for _, code, _ in programs)
+        measured[name] = {
+            stage: {'median': statistics.median(run[stage] for run in runs),
+                    'samples': [run[stage] for run in runs],
+                    'lines': lines, 'rounds': rounds}
+            for stage in gate_stages}
+    return measured
+
+
+def regressions(baseline, current, threshold):
+    """Compare measurements. Returns rows of (workload, stage, baseline
+    median, current median, change, regressed), medians in seconds per
+    line. A stage regressed when its median is more than `threshold`
+    slower, slower than every baseline sample, and slower by at least
+    gate_floor seconds over a sample, so that noise within the
+    baseline's own spread or the timer's resolution does not fail the
+    gate."""
+    rows = []
+    for name, stages in sorted(current.items()):
+        for stage, now in stages.items():
+            before = baseline.get(name, {}).get(stage)
+            if before is None or before['median'] <= 0:
+                continue
+            change = now['median'] / before['median'] - 1
+            lost = ((now['median'] - before['median'])
+                    * now['lines'] * now['rounds'])
+            regressed = (change > threshold
+                         and now['median'] > max(before['samples'])
+                         and lost >= gate_floor)
+            rows.append((name, stage, before['median'], now['median'],
+                         change, regressed))
+    return rows
+
+
+def bench_gate(corpus, subset, path, save, repeat, threshold):
+    """Time the gate workloads; save them as the baseline, or compare
+    them with it and exit non-zero on a throughput regression. Parsers
+    used from several threads must also build the same trees; that
+    check runs after the timing, so it does not disturb it."""
+    measured = measure_workloads(gate_workloads(corpus, subset), repeat)
+    if not check_threads():
+        exit(1)
+    if save:
+        with open(path, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'samples': repeat, 'unit': 'seconds per line',
+                       'workloads': measured}, f, indent=1)
+            f.write('\n')
+        print("saved baseline {}".format(path))
+        return
+    if not os.path.exists(path):
+        print("no baseline {}; run with --save first".format(path))
+        exit(2)
+    with open(path, 'r') as f:
+        baseline = json.load(f)
+    if baseline.get('unit') != 'seconds per line':
+        print("baseline {} predates per-line timing; run with --save again"
+              .format(path))
+        exit(2)
+    if baseline['python'] != platform.python_version():
+        print("warning: baseline taken with python {}, this is {}".format(
+            baseline['python'], platform.python_version()))
+    rows = regressions(baseline['workloads'], measured, threshold)
+    print("{:<10} {:<6} {:>14} {:>14} {:>8}".format(
+        "workload", "stage", "baseline", "current", "change"))
+    for name, stage, before, now, change, regressed in rows:
+        print("{:<10} {:<6} {:>9.3f}us/ln {:>9.3f}us/ln {:>+7.1%}{}".format(
+            name, stage, before * 1e6, now * 1e6, change,
+            "  REGRESSION" if regressed else ""))
+    failed = [row for row in rows if row[-1]]
+    if failed:
+        print("{} stage(s) slower than the baseline by more than {:.0%}"
+              .format(len(failed), threshold))
+        exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Validator benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    threads = sub.add_parser(
+        "threads", help="build and use parsers concurrently")
+    threads.add_argument(
+        "--threads", help="maximum number of threads", type=int, default=8)
+    threads.add_argument(
+        "--iterations", help="parses per thread", type=int, default=100)
+    daemon = sub.add_parser(
+        "daemon", help="request latency of the validation daemon")
+    daemon.add_argument(
+        "--requests", help="number of requests", type=int, default=1000)
+    daemon.add_argument(
+        "--workers", help="number of executor processes", type=int)
+    tokens = sub.add_parser(
+        "tokens", help="token throughput and memory per token")
+    tokens.add_argument(
+        "--depth", help="indentation depth", type=int, default=20)
+    tokens.add_argument(
+        "--repeat", help="number of nested blocks", type=int, default=200)
+    incremental = sub.add_parser(
+        "incremental", help="reparse a large program after a one-line edit")
+    incremental.add_argument(
+        "--functions", help="number of functions in the program",
+        type=int, default=600)
+    incremental.add_argument(
+        "--input", help="corpus directory whose programs are checked to"
+        " parse the same incrementally and in full")
+    corpus = sub.add_parser(
+        "corpus", help="throughput on a corpus of many small files")
+    corpus.add_argument(
+        "--files", help="number of files", type=int, default=2000)
+    corpus.add_argument(
+        "--jobs", help="number of worker processes", type=int)
+    corpus.add_argument(
+        "--stages", help="stages to run", type=stages_spec,
+        default=['nodes', 'parse'])
+    interp_check = sub.add_parser(
+        "interp", help="compare the built-in interpreter with python3")
+    interp_check.add_argument(
+        "--input", help="corpus directory",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "tests", "interp"))
+    gate = sub.add_parser(
+        "gate", help="compare stage throughput with a stored baseline")
+    gate.add_argument(
+        "--input", help="corpus directory to include as a workload")
+    gate.add_argument(
+        "--subset", help="subset of the corpus programs", default="p3")
+    gate.add_argument(
+        "--baseline", help="baseline JSON file",
+        default="bench-baseline.json")
+    gate.add_argument(
+        "--save", help="store this run as the baseline",
+        action="store_true")
+    gate.add_argument(
+        "--samples", help="timed runs per workload; medians are compared",
+        type=int, default=5)
+    gate.add_argument(
+        "--threshold", help="tolerated slowdown, as a fraction",
+        type=float, default=0.10)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.bench == "threads":
+        bench_threads(args.threads, args.iterations)
+    elif args.bench == "daemon":
+        bench_daemon(args.requests, args.workers)
+    elif args.bench == "tokens":
+        bench_tokens(args.depth, args.repeat)
+    elif args.bench == "incremental":
+        bench_incremental(args.functions, args.input)
+    elif args.bench == "corpus":
+        bench_corpus(args.files, args.jobs, args.stages)
+    elif args.bench == "interp":
+        bench_interp(args.input)
+    elif args.bench == "gate":
+        if not is_valid_subset(args.subset):
+            exit(2)
+        bench_gate(args.input, args.subset.lower(), args.baseline,
+                   args.save, args.samples, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
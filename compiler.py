@@ -0,0 +1,196 @@
+"""Differential testing of a compiler against python3.
+
+Every validated program is compiled with the user's compiler command,
+the output is built with a toolchain command and run, and the stdout of
+the run must equal the stdout python3 gives for the same stdin.
+
+Commands are templates, split like a shell would and then filled in:
+    {src}   the program           {asm}   the compiler's output
+    {exe}   the built executable  {dir}   a scratch directory per program
+Without a build command, {exe} is {asm}. For example:
+    --compiler-cmd="pyyc {src} -o {asm}"
+    --build-cmd="gcc -m32 -g {asm} runtime/libpyyruntime.a -lm -o {exe}"
+
+The compile, build and run stages each have their own pool of worker
+threads (the work happens in child processes), and a program moves on
+to the next stage as soon as it is done with one, so different programs
+are compiled, built and run at the same time.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+pipeline_stages = ('compile', 'build', 'run')
+
+
+def kill_group(popen):
+    """Kill a command started in a new session, and what it started."""
+    try:
+        os.killpg(popen.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class Toolchain(object):
+
+    def __init__(self, compile_cmd, build_cmd=None, run_cmd='{exe}',
+                 timeout=60):
+        self.commands = {'compile': compile_cmd, 'build': build_cmd,
+                         'run': run_cmd}
+        self.timeout = timeout
+
+    def command(self, stage, paths):
+        return [arg.format(**paths)
+                for arg in shlex.split(self.commands[stage])]
+
+
+class Pipeline(object):
+    """Runs programs through a Toolchain. `reference(code, stdin)`
+    gives the expected (ok, stdout, error), as val.run_python does,
+    for programs submitted without one."""
+
+    def __init__(self, toolchain, reference, workers=None):
+        self.toolchain = toolchain
+        self.reference = reference
+        workers = workers or os.cpu_count()
+        self.pools = {stage: ThreadPoolExecutor(workers)
+                      for stage in pipeline_stages}
+        self.scratch = tempfile.mkdtemp(prefix='pyyc-')
+        self.closed = False
+        self.cancelled = False
+        # commands running, each the leader of its own process group
+        self.running = set()
+        self.lock = threading.Lock()
+
+    def submit(self, file, code, indata, on_disk=True, expected=None):
+        """Start `file` down the pipeline. Returns a Future of its
+        verdict: `valid`, the failing `stage`, `error` and the time
+        of each stage run (`stages`). Programs that are not on disk
+        are written to the scratch directory for the compiler. The
+        `expected` (ok, stdout, error) of a python3 run already made
+        saves running the reference."""
+        work = tempfile.mkdtemp(dir=self.scratch)
+        base = os.path.splitext(os.path.basename(file))[0]
+        src = file
+        if not on_disk:
+            src = os.path.join(work, base + '.py')
+            with open(src, 'w') as f:
+                f.write(code)
+        paths = {'src': src, 'dir': work,
+                 'asm': os.path.join(work, base + '.s'),
+                 'exe': os.path.join(work, base)}
+        if self.toolchain.commands['build'] is None:
+            paths['exe'] = paths['asm']
+        job = {'file': file, 'code': code, 'indata': indata,
+               'paths': paths, 'work': work, 'expected': expected}
+        verdict = {'valid': False, 'stage': None, 'error': None,
+                   'stages': {}}
+        done = Future()
+        self.advance(job, verdict, done, 0)
+        return done
+
+    def advance(self, job, verdict, done, index):
+        stages = [stage for stage in pipeline_stages
+                  if self.toolchain.commands[stage] is not None]
+        if index == len(stages):
+            verdict['valid'] = True
+            self.finish(job, verdict, done)
+            return
+        stage = stages[index]
+        try:
+            if self.closed:
+                raise RuntimeError('pipeline closed')
+            future = self.pools[stage].submit(self.run_stage, stage, job,
+                                              verdict)
+        except RuntimeError:
+            verdict['stage'] = stage
+            verdict['error'] = 'cancelled'
+            self.finish(job, verdict, done)
+            return
+
+        def next_stage(future):
+            try:
+                passed = future.result()
+            except Exception as e:
+                verdict['stage'] = stage
+                verdict['error'] = '{}: {}'.format(type(e).__name__, e)
+                passed = False
+            if passed:
+                self.advance(job, verdict, done, index + 1)
+            else:
+                self.finish(job, verdict, done)
+        future.add_done_callback(next_stage)
+
+    def run_stage(self, stage, job, verdict):
+        start = time.perf_counter()
+        popen = subprocess.Popen(
+            self.toolchain.command(stage, job['paths']),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, text=True, start_new_session=True)
+        with self.lock:
+            self.running.add(popen)
+            if self.cancelled:
+                kill_group(popen)
+        try:
+            out, err = popen.communicate(
+                (job['indata'] or '') if stage == 'run' else '',
+                timeout=self.toolchain.timeout)
+        except subprocess.TimeoutExpired:
+            kill_group(popen)
+            popen.communicate()
+            verdict['stage'] = stage
+            verdict['error'] = 'timed out after {}s'.format(
+                self.toolchain.timeout)
+            return False
+        finally:
+            with self.lock:
+                self.running.discard(popen)
+            verdict['stages'][stage] = round(time.perf_counter() - start, 6)
+        if self.cancelled and popen.returncode == -signal.SIGKILL:
+            verdict['stage'] = stage
+            verdict['error'] = 'cancelled'
+            return False
+        if popen.returncode != 0:
+            verdict['stage'] = stage
+            verdict['error'] = 'exit status {}: {}'.format(
+                popen.returncode, err.strip())
+            return False
+        if stage != 'run':
+            return True
+        ok, expected, err = job['expected'] or \
+            self.reference(job['code'], job['indata'])
+        if not ok:
+            verdict['stage'] = stage
+            verdict['error'] = 'python3 failed, nothing to compare' \
+                ' with:\n {}'.format(err)
+            return False
+        if out != expected:
+            verdict['stage'] = stage
+            verdict['error'] = 'stdout differs from python3:\n' \
+                ' expected {!r}\n got      {!r}'.format(expected, out)
+            return False
+        return True
+
+    def finish(self, job, verdict, done):
+        shutil.rmtree(job['work'], ignore_errors=True)
+        done.set_result(verdict)
+
+    def close(self, cancel=False):
+        """Wait for the programs in a stage, dropping those queued.
+        With `cancel`, the commands running are killed instead."""
+        self.closed = True
+        if cancel:
+            with self.lock:
+                self.cancelled = True
+                for popen in self.running:
+                    kill_group(popen)
+        for stage in pipeline_stages:
+            self.pools[stage].shutdown(cancel_futures=True)
+        shutil.rmtree(self.scratch, ignore_errors=True)
@@ -0,0 +1,73 @@
+"""A corpus of programs packed into one shared memory segment.
+
+The parent process encodes every program and its stdin into a single
+multiprocessing.shared_memory block. Worker processes attach to the
+block by name and are handed only an entry of the offset index; they
+decode the program straight from a memoryview of the block, so sources
+are neither read from disk per worker nor pickled between processes.
+"""
+
+from multiprocessing import shared_memory
+
+
+class SharedCorpus(object):
+    """Programs in shared memory. `index` maps each program name to its
+    entry (offset, length, stdin offset, stdin length); a stdin length
+    of -1 means the program has no stdin."""
+
+    def __init__(self, shm, index, owner):
+        self.shm = shm
+        self.index = index
+        self.owner = owner
+
+    @classmethod
+    def create(cls, programs):
+        """Pack `programs`, an iterable of (name, code, stdin)."""
+        chunks = []
+        index = {}
+        offset = 0
+        for name, code, indata in programs:
+            data = code.encode()
+            entry = [offset, len(data)]
+            chunks.append(data)
+            offset += len(data)
+            if indata is None:
+                entry += [offset, -1]
+            else:
+                data = indata.encode()
+                entry += [offset, len(data)]
+                chunks.append(data)
+                offset += len(data)
+            index[name] = tuple(entry)
+        # a segment cannot be empty
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        start = 0
+        for data in chunks:
+            shm.buf[start:start + len(data)] = data
+            start += len(data)
+        return cls(shm, index, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Open the segment of a corpus made by another process."""
+        # worker processes share the creator's resource tracker, which
+        # forgets the segment once the creator unlinks it
+        return cls(shared_memory.SharedMemory(name=name), None, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def source(self, entry):
+        """(code, stdin) of the program at `entry`."""
+        offset, length, in_offset, in_length = entry
+        buf = self.shm.buf
+        code = str(buf[offset:offset + length], 'utf-8')
+        if in_length < 0:
+            return code, None
+        return code, str(buf[in_offset:in_offset + in_length], 'utf-8')
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,312 @@
+"""Long-running validator speaking JSON lines over a Unix domain
+socket or stdin/stdout. Parsers and the executor pool stay warm
+between requests, so a request costs neither interpreter startup,
+ply import nor table construction.
+
+Usage: python3 daemon.py (--socket=<path> | --stdio) \
+                         [--workers=<n>] [--exec-timeout=<seconds>] \
+                         [--code-cache=<dir>] \
+                         [--incremental] [--metrics=<path>] [--verbose]
+
+Requests, one JSON object per line:
+    {"id": 1, "path": "test.py", "subset": "p0"}
+    {"id": 2, "source": "print(input())", "input": "1", "subset": "p1",
+     "exec": false}
+
+Each request is answered with one line holding the verdict of
+validate_source, the request's `id` and `path`. A malformed request
+gets a verdict failing at the 'request' stage, and a request the
+validator itself fails on one failing at the 'internal' stage.
+"""
+
+from concurrent.futures import Future
+import multiprocessing
+import queue
+import socketserver
+import argparse
+import functools
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import val
+from metrics import Metrics
+from val import *
+
+
+def worker_loop(conn):
+    """Body of a WorkerPool process: run the calls sent down `conn`."""
+    while True:
+        call = conn.recv()
+        if call is None:
+            break
+        func, args = call
+        conn.send(func(*args))
+
+
+class WorkerPool(object):
+    """Warm processes running run_prog, one call at a time each. A call
+    that takes longer than `timeout` seconds has its process killed and
+    replaced, so a program that never ends holds no worker for good."""
+
+    def __init__(self, workers, timeout=None):
+        self.timeout = timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.idle = queue.Queue()
+        for _ in range(workers):
+            self.idle.put(self.start())
+
+    def start(self):
+        conn, child = self.context.Pipe()
+        process = self.context.Process(target=worker_loop, args=(child,),
+                                       daemon=True)
+        process.start()
+        child.close()
+        return process, conn
+
+    def submit(self, func, *args):
+        """Call func(*args) in a worker, blocking until it is done.
+        Returns a completed Future, like an executor's, of the result,
+        or of a failed run (ok false) if the worker timed out or died."""
+        process, conn = self.idle.get()
+        future = Future()
+        try:
+            conn.send((func, args))
+            if not conn.poll(self.timeout):
+                raise TimeoutError('timed out after {}s'.format(
+                    self.timeout))
+            future.set_result(conn.recv())
+        except (TimeoutError, EOFError, OSError) as e:
+            process.kill()
+            process.join()
+            conn.close()
+            process, conn = self.start()
+            future.set_result((False, '', '{}: {}'.format(
+                type(e).__name__, str(e) or 'worker exited')))
+        finally:
+            self.idle.put((process, conn))
+        return future
+
+    def shutdown(self):
+        while not self.idle.empty():
+            process, conn = self.idle.get()
+            conn.send(None)
+            process.join()
+            conn.close()
+
+
+class Validator(object):
+    """Warm state shared by every connection: one parser and lexer per
+    thread (or one shared IncrementalParser) and a pool of interpreter
+    processes."""
+
+    def __init__(self, workers=None, cache_dir=None, incremental=False,
+                 metrics=None, timeout=None):
+        self.workers = workers or os.cpu_count()
+        self.cache_dir = cache_dir
+        self.local = threading.local()
+        # one chunk cache for every connection, so that an editor
+        # resending a file only has its changed statements reparsed
+        self.incremental = IncrementalParser() if incremental else None
+        # a Metrics shared by the connections
+        self.metrics = metrics
+        self.metrics_lock = threading.Lock()
+        self.pool = WorkerPool(self.workers, timeout)
+        # have the workers import val now rather than on first requests
+        for _ in range(self.workers):
+            self.pool.submit(run_prog, '')
+
+    def parser(self):
+        if self.incremental is not None:
+            return self.incremental
+        if not hasattr(self.local, 'parser'):
+            self.local.parser = Parser()
+        return self.local.parser
+
+    def lexer(self):
+        if not hasattr(self.local, 'lexer'):
+            self.local.lexer = Lexer()
+        return self.local.lexer
+
+    def handle(self, request):
+        """Validate one request and return its verdict."""
+        if not isinstance(request, dict):
+            raise TypeError('a request is a JSON object, not {}'.format(
+                type(request).__name__))
+        for key in ('subset', 'path', 'source', 'input'):
+            if key in request and not isinstance(request[key], str) and \
+                    not (key == 'input' and request[key] is None):
+                raise TypeError('"{}" must be a string'.format(key))
+        subset = request.get('subset', 'p3')
+        if subset.lower() not in subset_tbl:
+            raise ValueError("Invalid python subset."
+                             " Supported subsets: {}".format(subset_tbl))
+        path = request.get('path')
+        if path is not None:
+            with open(path, 'r') as f:
+                code = f.read()
+            indata = request.get('input', read_input(path))
+        else:
+            code = request['source']
+            indata = request.get('input')
+        verdict = validate_source(subset, code, self.parser(), indata,
+                                  request.get('exec', True), self.pool,
+                                  cache_dir=self.cache_dir,
+                                  lexer=self.lexer())
+        if self.metrics is not None:
+            self.record(subset, verdict)
+        verdict['id'] = request.get('id')
+        verdict['path'] = path
+        return verdict
+
+    def record(self, subset, verdict):
+        with self.metrics_lock:
+            self.metrics.record(subset, verdict)
+            if self.incremental is not None:
+                self.metrics.set('validator_cache_hits',
+                                 self.incremental.hits, cache='chunks')
+                self.metrics.set('validator_cache_misses',
+                                 self.incremental.misses, cache='chunks')
+            self.metrics.update()
+
+    def handle_line(self, line):
+        request = {}
+        try:
+            request = json.loads(line)
+            verdict = self.handle(request)
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            verdict = self.failed(request, 'request', e)
+        except Exception as e:
+            # a program that breaks the validator, e.g. with a
+            # MemoryError in ast.parse, must not take the daemon down
+            verdict = self.failed(request, 'internal', e)
+        return json.dumps(verdict)
+
+    def failed(self, request, stage, e):
+        return {'valid': False, 'stage': stage,
+                'error': '{}: {}'.format(type(e).__name__, e),
+                'stdout': None,
+                'id': request.get('id')
+                      if isinstance(request, dict) else None,
+                'path': None}
+
+    def serve(self, rfile, wfile):
+        """Answer the JSON lines read from rfile until it is closed."""
+        for line in rfile:
+            if line.strip():
+                wfile.write(self.handle_line(line) + '\n')
+                wfile.flush()
+
+    def close(self):
+        self.pool.shutdown()
+        if self.metrics is not None:
+            self.metrics.write()
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        rfile = io.TextIOWrapper(self.rfile, encoding='utf-8')
+        wfile = io.TextIOWrapper(self.wfile, encoding='utf-8')
+        self.server.validator.serve(rfile, wfile)
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, validator):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.validator = validator
+        super().__init__(path, Handler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class Client(object):
+    """Blocking client for a daemon listening on a Unix socket.
+
+    with Client('/tmp/val.sock') as client:
+        verdict = client.validate(path='test.py', subset='p0')
+    """
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('r', encoding='utf-8')
+        self.wfile = self.sock.makefile('w', encoding='utf-8')
+
+    def validate(self, **request):
+        self.wfile.write(json.dumps(request) + '\n')
+        self.wfile.flush()
+        return json.loads(self.rfile.readline())
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Validation daemon")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument(
+        "--socket", help="path of the Unix socket to listen on")
+    mode.add_argument(
+        "--stdio", help="serve requests on stdin/stdout",
+        action="store_true")
+    parser.add_argument(
+        "--workers", help="number of executor processes", type=int)
+    parser.add_argument(
+        "--exec-timeout", help="seconds a program may run before its"
+        " executor process is killed and replaced", type=float, default=10)
+    parser.add_argument(
+        "--code-cache", help="directory keeping the compiled programs"
+        " across restarts")
+    parser.add_argument(
+        "--incremental", help="reparse only the top-level statements"
+        " that changed since a program was last seen",
+        action="store_true")
+    parser.add_argument(
+        "--metrics", help="keep an OpenMetrics textfile of the"
+        " validator's counters and latencies up to date",
+        metavar="PATH")
+    parser.add_argument(
+        "--verbose", help="print verbose output to stderr",
+        action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.verbose:
+        # stdout may be carrying the protocol
+        val.verboseprint = functools.partial(print, file=sys.stderr)
+    validator = Validator(args.workers, args.code_cache, args.incremental,
+                          Metrics(args.metrics) if args.metrics else None,
+                          args.exec_timeout)
+    try:
+        if args.stdio:
+            validator.serve(sys.stdin, sys.stdout)
+        else:
+            with Server(args.socket, validator) as server:
+                server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        validator.close()
+
+
+if __name__ == "__main__":
+    main()
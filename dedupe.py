@@ -0,0 +1,116 @@
+"""Duplicate-test detection by normalized AST fingerprint.
+
+Two tests are duplicates when their trees are the same once the names
+the program binds are alpha-renamed (and, with --abstract-constants,
+constants are reduced to their type) and they read the same input.
+Whitespace and comments never reach the tree.
+
+Usage: python3 dedupe.py --subset=<python-subset> \
+                         --input=<file|dir|archive> \
+                         [--abstract-constants] [--run] \
+                         [--executor=<python3|native>] [--verbose]
+
+Example: python3 dedupe.py --subset=P2 --input=tests/ --run
+"""
+
+from collections import defaultdict
+import argparse
+import hashlib
+import time
+from val import *
+from asthash import ast_hash
+
+
+def fingerprint(subset, file, parser, abstract_constants=False,
+                source=None):
+    """Normalized fingerprint of a test, or None if it does not parse.
+    `source` is its (code, stdin), if already read."""
+    code, indata = source or read_source(file)
+    try:
+        tree = parse_source(subset, code, parser)
+    except ValidationError:
+        return None
+    return '{}.{}'.format(
+        ast_hash(tree, rename=True, abstract_constants=abstract_constants),
+        hashlib.blake2b((indata or '').encode(), digest_size=8).hexdigest()
+        if indata is not None else '-')
+
+
+def group_tests(subset, files, parser, abstract_constants=False,
+                source=read_source):
+    """Group equivalent tests. Returns a list of groups (lists of files,
+    representative first); tests that do not parse stay on their own.
+    `source` reads the (code, stdin) of a test."""
+    groups = defaultdict(list)
+    for file in files:
+        key = fingerprint(subset, file, parser, abstract_constants,
+                          source(file))
+        groups[key or file].append(file)
+    return list(groups.values())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Find duplicate tests by normalized AST fingerprint")
+    parser.add_argument(
+        "--subset", help="python subset to parse with", required=True)
+    parser.add_argument(
+        "--input", help="input file(s) to check: a file, a directory"
+        " or a tar/zip archive", required=True)
+    parser.add_argument(
+        "--abstract-constants", help="ignore the values of constants",
+        action="store_true")
+    parser.add_argument(
+        "--run", help="validate one representative per group",
+        action="store_true")
+    parser.add_argument(
+        "--executor", help="how to run the representatives",
+        choices=['python3', 'native'], default='python3')
+    parser.add_argument(
+        "--verbose", help="print every group, not only duplicates",
+        action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not is_valid_subset(args.subset):
+        exit(1)
+    files, source = open_programs(args.input)
+    parser = Parser(args.subset)
+    start = time.perf_counter()
+    groups = group_tests(args.subset, files, parser,
+                         args.abstract_constants, source)
+    elapsed = time.perf_counter() - start
+    duplicates = sum(len(group) - 1 for group in groups)
+    for group in groups:
+        if len(group) > 1 or args.verbose:
+            print('{} ({} tests)'.format(group[0], len(group)))
+            for file in group[1:]:
+                print('  = {}'.format(file))
+    print('{} tests, {} groups, {} duplicates; fingerprinting took {:.3f}s'
+          .format(len(files), len(groups), duplicates, elapsed))
+    if not args.run:
+        return
+    saved = 0.0
+    invalid = 0
+    for group in groups:
+        code, indata = source(group[0])
+        start = time.perf_counter()
+        verdict = validate_source(args.subset, code, parser,
+                                  indata,
+                                  native=args.executor == 'native')
+        elapsed = time.perf_counter() - start
+        # every duplicate would have cost about as much as its representative
+        saved += elapsed * (len(group) - 1)
+        if not verdict['valid']:
+            invalid += len(group)
+            print('invalid ({} stage): {}'.format(verdict['stage'],
+                                                  ', '.join(group)))
+    print('{} of {} tests invalid; {} runs skipped, saving about {:.3f}s'
+          .format(invalid, len(files), duplicates, saved))
+    exit(1 if invalid else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
-grammar = {
-    'p3' : [
+subsets = ['p0', 'p1', 'p2', 'p3']
+
+# The grammar of every subset is expressed as a delta on top of the
+# subset before it. A delta entry for a rule that already exists appends
+# its alternatives to that rule. The subsets are merged into one grammar
+# (see compose) so a single LALR table serves all of them, and the
+# parser rejects productions that lie outside the subset being parsed.
+deltas = {
+    'p0' : [
             ('p_module', 
                 """
                 module : statements 
@@ -15,7 +22,6 @@ grammar = {
             ('p_statement', 
                 """
                 statement : stmt_list NEWLINE
-                        | compound_stmt
                 """
             ),
             ('p_stmt_list', 
@@ -27,14 +33,6 @@ grammar = {
                 """
                 simple_stmt : expression_stmt
                         | assignment_stmt
-                        | return_stmt
-                """
-            ),
-            ('p_compound_stmt', 
-                """
-                compound_stmt : if_stmt
-                            | while_stmt
-                            | funcdef
                 """
             ),
             ('p_expression_stmt', 
@@ -57,7 +55,6 @@ grammar = {
                 target : identifier
                         | LPAREN target_list RPAREN
                         | LBRACKET target_list RBRACKET
-                        | subscription
                 """
             ),
             ('p_atom', 
@@ -70,15 +67,11 @@ grammar = {
             ('p_literal', 
                 """
                 literal : integer
-                        | TRUE
-                        | FALSE
                 """
             ),
             ('p_enclosure', 
                 """
                 enclosure : parenth_form
-                        | list_display
-                        | dict_display
                 """
             ),
             ('p_parenth_form', 
@@ -86,38 +79,10 @@ grammar = {
                 parenth_form : LPAREN expression RPAREN
                 """
             ),
-            ('p_list_display', 
-                """
-                list_display : LBRACKET expression_list RBRACKET
-                """
-            ),
-            ('p_dict_display', 
-                """
-                dict_display : LBRACE key_datum_list RBRACE
-                """
-            ),
-            ('p_key_datum_list', 
-                """
-                key_datum_list : key_datum_list COMMA key_datum
-                        | key_datum
-                        | empty
-                """
-            ),
-            ('p_key_datum', 
-                """
-                key_datum : expression COLON expression
-                """
-            ),
-            ('p_subscription', 
-                """
-                subscription : primary LBRACKET expression_list RBRACKET
-                """
-            ),
             ('p_primary', 
                 """
                 primary : atom
                         | call
-                        | subscription
                 """
             ),
             ('p_call', 
@@ -142,71 +107,36 @@ grammar = {
                 positional_item : expression
                 """
             ),
-            ('p_expression_list', 
-                """
-                expression_list : expression_list COMMA expression
-                            | expression
-                            | empty
-                """
-            ),
+            # P0 expressions reach a_expr through the chain of unit
+            # productions that the operators of P1 hang off.
             ('p_expression', 
                 """
                 expression : conditional_expression
-                        | lambda_expr
                 """
             ),
             ('p_conditional_expression', 
                 """
                 conditional_expression : or_test
-                                    | or_test IF or_test ELSE conditional_expression
-                """
-            ),
-            ('p_lambda_expr', 
-                """
-                lambda_expr : LAMBDA parameter_list COLON expression
-                """
-            ),
-            ('p_parameter_list', 
-                """
-                parameter_list : parameter_list COMMA parameter
-                        | parameter
-                        | empty
-                """
-            ),
-            ('p_parameter', 
-                """
-                parameter : identifier
                 """
             ),
             ('p_or_test', 
                 """
                 or_test : and_test
-                        | or_test OR and_test
                 """
             ),
             ('p_and_test', 
                 """
                 and_test : not_test
-                    | and_test AND not_test
                 """
             ),
             ('p_not_test', 
                 """
-                not_test : NOT not_test
-                        | comparison
+                not_test : comparison
                 """
             ),
             ('p_comparison', 
                 """
-                comparison : comparison comp_operator a_expr
-                        | a_expr
-                """
-            ),
-            ('p_comp_operator', 
-                """
-                comp_operator : EQ
-                            | NE
-                            | IS
+                comparison : a_expr
                 """
             ),
             ('p_a_expr', 
@@ -220,38 +150,6 @@ grammar = {
                         | MINUS u_expr %prec UMINUS
                 """
             ),
-            ('p_if_stmt', 
-                """
-                if_stmt : IF expression COLON suite
-                        | IF expression COLON suite ELSE COLON suite
-                """
-            ),
-            ('p_while_stmt', 
-                """
-                while_stmt : WHILE expression COLON suite
-                """
-            ),
-            ('p_funcdef', 
-                """
-                funcdef : DEF funcname LPAREN parameter_list RPAREN COLON suite
-                """
-            ),
-            ('p_funcname', 
-                """
-                funcname : identifier
-                """
-            ),
-            ('p_return_stmt', 
-                """
-                return_stmt : RETURN expression_list
-                """
-            ),
-            ('p_suite', 
-                """
-                suite : stmt_list NEWLINE
-                    | NEWLINE INDENT statements DEDENT
-                """
-            ),
             ('p_empty', 
                 """
                 empty : 
@@ -259,91 +157,24 @@ grammar = {
             )
         ],
 
-    'p2' : [
-            ('p_module', 
-                """
-                module : statements 
-                        | NEWLINE
-                """
-            ),
-            ('p_statements', 
-                """
-                statements : statement statements
-                        | statement
-                """
-            ),
-            ('p_statement', 
-                """
-                statement : stmt_list NEWLINE
-                        | compound_stmt
-                """
-            ),
-            ('p_stmt_list', 
-                """
-                stmt_list : simple_stmt
-                """
-            ),
-            ('p_simple_stmt', 
-                """
-                simple_stmt : expression_stmt
-                        | assignment_stmt
-                        | return_stmt
-                """
-            ),
-            ('p_compound_stmt', 
-                """
-                compound_stmt : funcdef
-                """
-            ),
-            ('p_expression_stmt', 
-                """
-                expression_stmt : expression
-                """
-            ),
-            ('p_assignment_stmt', 
-                """
-                assignment_stmt : target_list ASSIGN expression
-                """
-            ),
-            ('p_target_list', 
-                """
-                target_list : target
-                """
-            ),
+    'p1' : [
             ('p_target', 
                 """
-                target : identifier
-                        | LPAREN target_list RPAREN
-                        | LBRACKET target_list RBRACKET
-                        | subscription
-                """
-            ),
-            ('p_atom', 
-                """
-                atom : identifier
-                        | literal
-                        | enclosure
+                target : subscription
                 """
             ),
             ('p_literal', 
                 """
-                literal : integer
-                        | TRUE
+                literal : TRUE
                         | FALSE
                 """
             ),
             ('p_enclosure', 
                 """
-                enclosure : parenth_form
-                        | list_display
+                enclosure : list_display
                         | dict_display
                 """
             ),
-            ('p_parenth_form', 
-                """
-                parenth_form : LPAREN expression RPAREN
-                """
-            ),
             ('p_list_display', 
                 """
                 list_display : LBRACKET expression_list RBRACKET
@@ -373,50 +204,69 @@ grammar = {
             ),
             ('p_primary', 
                 """
-                primary : atom
-                        | call
-                        | subscription
+                primary : subscription
                 """
             ),
-            ('p_call', 
+            ('p_expression_list', 
                 """
-                call : primary LPAREN argument_list RPAREN
+                expression_list : expression_list COMMA expression
+                            | expression
+                            | empty
                 """
             ),
-            ('p_argument_list', 
+            ('p_conditional_expression', 
                 """
-                argument_list : positional_arguments
+                conditional_expression : or_test IF or_test ELSE conditional_expression
                 """
             ),
-            ('p_positional_arguments', 
+            ('p_or_test', 
                 """
-                positional_arguments : positional_arguments COMMA positional_item
-                                | positional_item
-                                | empty
+                or_test : or_test OR and_test
                 """
             ),
-            ('p_positional_item', 
+            ('p_and_test', 
                 """
-                positional_item : expression
+                and_test : and_test AND not_test
                 """
             ),
-            ('p_expression_list', 
+            ('p_not_test', 
                 """
-                expression_list : expression_list COMMA expression
-                            | expression
-                            | empty
+                not_test : NOT not_test
                 """
             ),
-            ('p_expression', 
+            ('p_comparison', 
                 """
-                expression : conditional_expression
-                        | lambda_expr
+                comparison : comparison comp_operator a_expr
                 """
             ),
-            ('p_conditional_expression', 
+            ('p_comp_operator', 
                 """
-                conditional_expression : or_test
-                                    | or_test IF or_test ELSE conditional_expression
+                comp_operator : EQ
+                            | NE
+                            | IS
+                """
+            )
+        ],
+
+    'p2' : [
+            ('p_statement', 
+                """
+                statement : compound_stmt
+                """
+            ),
+            ('p_simple_stmt', 
+                """
+                simple_stmt : return_stmt
+                """
+            ),
+            ('p_compound_stmt', 
+                """
+                compound_stmt : funcdef
+                """
+            ),
+            ('p_expression', 
+                """
+                expression : lambda_expr
                 """
             ),
             ('p_lambda_expr', 
@@ -436,400 +286,80 @@ grammar = {
                 parameter : identifier
                 """
             ),
-            ('p_or_test', 
+            ('p_funcdef', 
                 """
-                or_test : and_test
-                        | or_test OR and_test
+                funcdef : DEF funcname LPAREN parameter_list RPAREN COLON suite
                 """
             ),
-            ('p_and_test', 
+            ('p_funcname', 
                 """
-                and_test : not_test
-                    | and_test AND not_test
+                funcname : identifier
                 """
             ),
-            ('p_not_test', 
+            ('p_return_stmt', 
                 """
-                not_test : NOT not_test
-                        | comparison
+                return_stmt : RETURN expression_list
                 """
             ),
-            ('p_comparison', 
+            ('p_suite', 
                 """
-                comparison : comparison comp_operator a_expr
-                        | a_expr
+                suite : stmt_list NEWLINE
+                    | NEWLINE INDENT statements DEDENT
                 """
-            ),
-            ('p_comp_operator', 
+            )
+        ],
+
+    'p3' : [
+            ('p_compound_stmt', 
                 """
-                comp_operator : EQ
-                            | NE
-                            | IS
+                compound_stmt : if_stmt
+                            | while_stmt
                 """
             ),
-            ('p_a_expr', 
+            ('p_if_stmt', 
                 """
-                a_expr : a_expr PLUS u_expr
-                        | u_expr
-                """),
-            ('p_u_expr', 
-                """
-                u_expr : primary
-                        | MINUS u_expr %prec UMINUS
-                """
-            ),
-            ('p_funcdef', 
-                """
-                funcdef : DEF funcname LPAREN parameter_list RPAREN COLON suite
-                """
-            ),
-            ('p_funcname', 
-                """
-                funcname : identifier
-                """
-            ),
-            ('p_return_stmt', 
-                """
-                return_stmt : RETURN expression_list
-                """
-            ),
-            ('p_suite', 
-                """
-                suite : stmt_list NEWLINE
-                    | NEWLINE INDENT statements DEDENT
+                if_stmt : IF expression COLON suite
+                        | IF expression COLON suite ELSE COLON suite
                 """
             ),
-            ('p_empty', 
+            ('p_while_stmt', 
                 """
-                empty : 
+                while_stmt : WHILE expression COLON suite
                 """
             )
         ],
+}
 
-    'p1' : [
-            ('p_module', 
-                """
-                module : statements 
-                        | NEWLINE
-                """
-            ),
-            ('p_statements', 
-                """
-                statements : statement statements
-                        | statement
-                """
-            ),
-            ('p_statement', 
-                """
-                statement : stmt_list NEWLINE
-                """
-            ),
-            ('p_stmt_list', 
-                """
-                stmt_list : simple_stmt
-                """
-            ),
-            ('p_simple_stmt', 
-                """
-                simple_stmt : expression_stmt
-                        | assignment_stmt
-                """
-            ),
-            ('p_expression_stmt', 
-                """
-                expression_stmt : expression
-                """
-            ),
-            ('p_assignment_stmt', 
-                """
-                assignment_stmt : target_list ASSIGN expression
-                """
-            ),
-            ('p_target_list', 
-                """
-                target_list : target
-                """
-            ),
-            ('p_target', 
-                """
-                target : identifier
-                        | LPAREN target_list RPAREN
-                        | LBRACKET target_list RBRACKET
-                        | subscription
-                """
-            ),
-            ('p_atom', 
-                """
-                atom : identifier
-                        | literal
-                        | enclosure
-                """
-            ),
-            ('p_literal', 
-                """
-                literal : integer
-                        | TRUE
-                        | FALSE
-                """
-            ),
-            ('p_enclosure', 
-                """
-                enclosure : parenth_form
-                        | list_display
-                        | dict_display
-                """
-            ),
-            ('p_parenth_form', 
-                """
-                parenth_form : LPAREN expression RPAREN
-                """
-            ),
-            ('p_list_display', 
-                """
-                list_display : LBRACKET expression_list RBRACKET
-                """
-            ),
-            ('p_dict_display', 
-                """
-                dict_display : LBRACE key_datum_list RBRACE
-                """
-            ),
-            ('p_key_datum_list', 
-                """
-                key_datum_list : key_datum_list COMMA key_datum
-                        | key_datum
-                        | empty
-                """
-            ),
-            ('p_key_datum', 
-                """
-                key_datum : expression COLON expression
-                """
-            ),
-            ('p_subscription', 
-                """
-                subscription : primary LBRACKET expression_list RBRACKET
-                """
-            ),
-            ('p_primary', 
-                """
-                primary : atom
-                        | call
-                        | subscription
-                """
-            ),
-            ('p_call', 
-                """
-                call : primary LPAREN argument_list RPAREN
-                """
-            ),
-            ('p_argument_list', 
-                """
-                argument_list : positional_arguments
-                """
-            ),
-            ('p_positional_arguments', 
-                """
-                positional_arguments : positional_arguments COMMA positional_item
-                                | positional_item
-                                | empty
-                """
-            ),
-            ('p_positional_item', 
-                """
-                positional_item : expression
-                """
-            ),
-            ('p_expression_list', 
-                """
-                expression_list : expression_list COMMA expression
-                            | expression
-                            | empty
-                """
-            ),
-            ('p_expression', 
-                """
-                expression : conditional_expression
-                """
-            ),
-            ('p_conditional_expression', 
-                """
-                conditional_expression : or_test
-                                    | or_test IF or_test ELSE conditional_expression
-                """
-            ),
-            ('p_or_test', 
-                """
-                or_test : and_test
-                        | or_test OR and_test
-                """
-            ),
-            ('p_and_test', 
-                """
-                and_test : not_test
-                    | and_test AND not_test
-                """
-            ),
-            ('p_not_test', 
-                """
-                not_test : NOT not_test
-                        | comparison
-                """
-            ),
-            ('p_comparison', 
-                """
-                comparison : comparison comp_operator a_expr
-                        | a_expr
-                """
-            ),
-            ('p_comp_operator', 
-                """
-                comp_operator : EQ
-                            | NE
-                            | IS
-                """
-            ),
-            ('p_a_expr', 
-                """
-                a_expr : a_expr PLUS u_expr
-                        | u_expr
-                """),
-            ('p_u_expr', 
-                """
-                u_expr : primary
-                        | MINUS u_expr %prec UMINUS
-                """
-            ),
-            ('p_empty', 
-                """
-                empty : 
-                """
-            )
-        ],
 
-    'p0' : [
-            ('p_module', 
-                """
-                module : statements 
-                        | NEWLINE
-                """
-            ),
-            ('p_statements', 
-                """
-                statements : statement statements
-                        | statement
-                """
-            ),
-            ('p_statement', 
-                """
-                statement : stmt_list NEWLINE
-                """
-            ),
-            ('p_stmt_list', 
-                """
-                stmt_list : simple_stmt
-                """
-            ),
-            ('p_simple_stmt', 
-                """
-                simple_stmt : expression_stmt
-                        | assignment_stmt
-                """
-            ),
-            ('p_expression_stmt', 
-                """
-                expression_stmt : expression
-                """
-            ),
-            ('p_assignment_stmt', 
-                """
-                assignment_stmt : target_list ASSIGN expression
-                """
-            ),
-            ('p_target_list', 
-                """
-                target_list : target
-                """
-            ),
-            ('p_target', 
-                """
-                target : identifier
-                        | LPAREN target_list RPAREN
-                        | LBRACKET target_list RBRACKET
-                """
-            ),
-            ('p_atom', 
-                """
-                atom : identifier
-                        | literal
-                        | enclosure
-                """
-            ),
-            ('p_literal', 
-                """
-                literal : integer
-                """
-            ),
-            ('p_enclosure', 
-                """
-                enclosure : parenth_form
-                """
-            ),
-            ('p_parenth_form', 
-                """
-                parenth_form : LPAREN expression RPAREN
-                """
-            ),
-            ('p_primary', 
-                """
-                primary : atom
-                        | call
-                """
-            ),
-            ('p_call', 
-                """
-                call : primary LPAREN argument_list RPAREN
-                """
-            ),
-            ('p_argument_list', 
-                """
-                argument_list : positional_arguments
-                """
-            ),
-            ('p_positional_arguments', 
-                """
-                positional_arguments : positional_arguments COMMA positional_item
-                                | positional_item
-                                | empty
-                """
-            ),
-            ('p_positional_item', 
-                """
-                positional_item : expression
-                """
-            ),
-            ('p_expression', 
-                """
-                expression : a_expr
-                """
-            ),
-            ('p_a_expr', 
-                """
-                a_expr : a_expr PLUS u_expr
-                        | u_expr
-                """),
-            ('p_u_expr', 
-                """
-                u_expr : primary
-                        | MINUS u_expr %prec UMINUS
-                """
-            ),
-            ('p_empty', 
-                """
-                empty : 
-                """
-            )
-        ],
+def alternatives(doc):
+    """Split a rule docstring into the rule name and its alternatives."""
+    name, rhs = doc.split(':', 1)
+    return name.strip(), [' '.join(alt.split()) for alt in rhs.split('|')]
+
+
+def production_name(name, alt):
+    """Name a production the way ply does (MiniProduction.str),
+    e.g. 'a_expr -> a_expr PLUS u_expr' or 'empty -> <empty>'."""
+    syms = alt.split('%prec')[0].split()
+    return '{} -> {}'.format(name, ' '.join(syms) if syms else '<empty>')
+
+
+def compose(deltas):
+    """Merge the subset deltas into a single grammar.
+
+    Returns the merged (function, docstring) list and a dict mapping
+    every production to the index of the subset that introduces it."""
+    rules = {}
+    levels = {}
+    for level, subset in enumerate(subsets):
+        for func, doc in deltas[subset]:
+            name, alts = alternatives(doc)
+            rules.setdefault(func, (name, []))[1].extend(alts)
+            for alt in alts:
+                levels[production_name(name, alt)] = level
+    merged = [(func, '\n{} : {}\n'.format(name, '\n    | '.join(alts)))
+              for func, (name, alts) in rules.items()]
+    return merged, levels
+
 
-    
-}
\ No newline at end of file
+grammar, grammar_levels = compose(deltas)
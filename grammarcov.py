@@ -0,0 +1,126 @@
+"""Grammar coverage of a test corpus, and corpus minimization.
+
+Records which productions of grammar.py each test reduces and which
+AST node types of val.nodes its tree contains, then picks a small set
+of tests with the same combined coverage (greedy set cover followed by
+dropping tests the rest of the selection already covers).
+
+Usage: python3 grammarcov.py --subset=<python-subset> \
+                             --input=<file|dir|archive> \
+                             [--minimize] [--output=<file>] [--verbose]
+
+Example: python3 grammarcov.py --subset=P3 --input=tests/ \
+                               --minimize --output=precommit.txt
+"""
+
+import argparse
+import ast
+from val import *
+
+
+def test_coverage(subset, file, parser, source=None):
+    """The productions and node types `file` covers, as one set of
+    ('production', name) and ('node', name) items, or None if the
+    file does not parse. `source` is its (code, stdin), if already
+    read."""
+    code, _ = source or read_source(file)
+    try:
+        tree = parse_source(subset, code, parser)
+    except ValidationError:
+        return None
+    items = {('production', name) for name in parser.hits}
+    items.update(('node', type(node).__name__) for node in ast.walk(tree))
+    return items
+
+
+def corpus_items(subset):
+    """Everything there is to cover in `subset`."""
+    level = subset_tbl.index(subset.lower())
+    items = {('production', name)
+             for name, l in grammar_levels.items() if l <= level}
+    items.update(('node', node.__name__)
+                 for group in nodes[:level + 1] for node in group)
+    return items
+
+
+def minimize(coverage):
+    """Pick a small set of tests whose combined coverage equals that of
+    all of `coverage` (a dict of test -> set of items)."""
+    uncovered = set().union(*coverage.values()) if coverage else set()
+    selected = []
+    while uncovered:
+        # most new items first; smaller tests and then names break ties
+        best = max(sorted(coverage),
+                   key=lambda t: (len(coverage[t] & uncovered),
+                                  -len(coverage[t])))
+        selected.append(best)
+        uncovered -= coverage[best]
+    # a test picked early may be covered by the ones picked after it
+    for test in list(selected):
+        others = set().union(*(coverage[t] for t in selected if t != test))
+        if coverage[test] <= others:
+            selected.remove(test)
+    return selected
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Grammar coverage and corpus minimization")
+    parser.add_argument(
+        "--subset", help="python subset to parse with", required=True)
+    parser.add_argument(
+        "--input", help="input file(s) to measure: a file, a directory"
+        " or a tar/zip archive", required=True)
+    parser.add_argument(
+        "--minimize", help="select a minimal set of tests with the same"
+        " coverage", action="store_true")
+    parser.add_argument(
+        "--output", help="write the selected tests to this file,"
+        " one per line")
+    parser.add_argument(
+        "--verbose", help="print the coverage of every test",
+        action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not is_valid_subset(args.subset):
+        exit(1)
+    files, source = open_programs(args.input)
+    parser = Parser(args.subset, coverage=True)
+    coverage = {}
+    for file in files:
+        items = test_coverage(args.subset, file, parser, source(file))
+        if items is None:
+            print('{}: does not parse, skipped'.format(file))
+            continue
+        coverage[file] = items
+        if args.verbose:
+            print('{}: {} productions, {} node types'.format(
+                file, sum(kind == 'production' for kind, _ in items),
+                sum(kind == 'node' for kind, _ in items)))
+    covered = set().union(*coverage.values()) if coverage else set()
+    possible = corpus_items(args.subset)
+    for kind in ('production', 'node'):
+        total = {name for k, name in possible if k == kind}
+        hit = {name for k, name in covered if k == kind}
+        print('{}s: {} of {} covered'.format(kind, len(hit & total),
+                                             len(total)))
+        for name in sorted(total - hit):
+            print('  not covered: {}'.format(name))
+    if args.minimize:
+        selected = minimize(coverage)
+        print('{} of {} tests ({:.1%}) give the same coverage'.format(
+            len(selected), len(coverage),
+            len(selected) / max(len(coverage), 1)))
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.writelines(test + '\n' for test in selected)
+        else:
+            for test in selected:
+                print('  {}'.format(test))
+
+
+if __name__ == "__main__":
+    main()
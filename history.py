@@ -0,0 +1,87 @@
+"""Historical per-file stage durations, kept in a local SQLite database.
+
+Every run with --history records how long each stage (parse, nodes,
+exec) took for each file. The history gives the expected runtime of a
+file (the median of its last runs), which is used to schedule the
+longest work first and to flag files whose runtime regressed. It is not
+used to assign files to shards: each machine's history differs, and
+the shards must not.
+"""
+
+import sqlite3
+import statistics
+import time
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS durations (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    file TEXT NOT NULL,
+    subset TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS durations_file ON durations (file, subset, run);
+"""
+
+# runs the expected duration of a file is the median of
+recent_runs = 5
+# a file is flagged only if it got slower by at least this many seconds,
+# so that noise on very fast files is not reported
+regression_floor = 0.01
+
+
+class History(object):
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+
+    def expected(self, subset, files, stages=('nodes', 'parse', 'exec')):
+        """Expected runtime of `stages` for each of `files`
+        that has history."""
+        expected = {}
+        marks = ', '.join('?' * len(stages))
+        for file in files:
+            rows = self.db.execute(
+                "SELECT SUM(seconds) FROM durations"
+                " WHERE file = ? AND subset = ? AND stage IN ({})"
+                " GROUP BY run ORDER BY run DESC LIMIT ?".format(marks),
+                (file, subset.lower(), *stages, recent_runs)).fetchall()
+            if rows:
+                expected[file] = statistics.median(row[0] for row in rows)
+        return expected
+
+    def record(self, subset, results):
+        """Record the stage durations of a run's results."""
+        with self.db:
+            run = self.db.execute("INSERT INTO runs (started) VALUES (?)",
+                                  (time.time(),)).lastrowid
+            self.db.executemany(
+                "INSERT INTO durations VALUES (?, ?, ?, ?, ?)",
+                [(run, result['file'], subset.lower(), stage, seconds)
+                 for result in results
+                 for stage, seconds in result['stages'].items()])
+
+    def close(self):
+        self.db.close()
+
+
+def longest_first(files, expected):
+    """Order files longest-processing-time first. Files without history
+    are expected to take the mean, ties keep the file order."""
+    default = (sum(expected.values()) / len(expected)) if expected else 0.0
+    return sorted(files, key=lambda file: -expected.get(file, default))
+
+
+def regressed(result, expected, threshold):
+    """Whether a result took more than `threshold` times
+    its expected runtime."""
+    if result['file'] not in expected:
+        return False
+    before = expected[result['file']]
+    return result['time'] > before * threshold \
+        and result['time'] - before >= regression_floor
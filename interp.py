@@ -0,0 +1,471 @@
+"""Tree-walking interpreter for the P0-P3 subsets.
+
+Runs the tree built by the ply Parser inside the validator, so the
+execution stage needs no python3 process. The tree is compiled once
+into nested closures, one per node, which are then run against the
+program's input.
+
+Values are plain Python ints, bools, lists and dicts, so arithmetic,
+comparison, truthiness and printing behave exactly as in CPython.
+Like CPython (3.8 and later), equal constants are shared by the whole
+module, its functions and lambdas included, which is what `is` observes
+for equal int constants; negations
+and sums of constants are folded into constants first, as CPython's AST
+optimizer does, so `-1000 is -1000` and `999 + 1 is 1000`. Scoping
+follows Python's rules: names assigned in a function are local to it,
+other names resolve through the enclosing functions (late-binding
+closures) to the module globals and then the builtins (print, input
+and int, the conversion programs apply to input()).
+"""
+
+import ast
+import io
+import operator
+import sys
+import traceback
+
+# CPython's default recursion limit
+max_depth = 1000
+
+compare_ops = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Is: operator.is_,
+}
+
+
+class ReturnValue(Exception):
+    """Unwinds a function body on `return`."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Frame(object):
+    __slots__ = ('vars', 'parent')
+
+    def __init__(self, vars, parent):
+        self.vars = vars
+        self.parent = parent
+
+
+class Function(object):
+    """A function or lambda defined by the program."""
+    __slots__ = ('name', 'params', 'body', 'closure', 'interp')
+
+    def __init__(self, name, params, body, closure, interp):
+        self.name = name
+        self.params = params
+        self.body = body
+        self.closure = closure
+        self.interp = interp
+
+    def __call__(self, *args):
+        if len(args) != len(self.params):
+            raise TypeError(
+                "{}() takes {} positional arguments but {} were given"
+                .format(self.name, len(self.params), len(args)))
+        interp = self.interp
+        if interp.depth >= max_depth:
+            raise RecursionError("maximum recursion depth exceeded")
+        interp.depth += 1
+        try:
+            return self.body(Frame(dict(zip(self.params, args)),
+                                   self.closure))
+        finally:
+            interp.depth -= 1
+
+    def __repr__(self):
+        return '<function {} at {:#x}>'.format(self.name, id(self))
+
+
+class Scope(object):
+    """Compile-time view of the module or of a function or lambda body."""
+
+    def __init__(self, parent=None, locals=()):
+        self.parent = parent
+        self.locals = set(locals)
+        # CPython shares equal constants within one compiled module
+        self.consts = parent.consts if parent else {}
+
+    def resolve(self, name):
+        """Where a name lives: ('local', 0), ('free', <number of
+        enclosing functions to walk up>) or ('global', 0)."""
+        if self.parent is None:
+            return 'global', 0
+        if name in self.locals:
+            return 'local', 0
+        scope, depth = self.parent, 1
+        while scope.parent is not None:
+            if name in scope.locals:
+                return 'free', depth
+            scope, depth = scope.parent, depth + 1
+        return 'global', 0
+
+
+# what folded() returns for an expression that is not a constant
+not_constant = object()
+
+
+def folded(node):
+    """The constant CPython's AST optimizer folds `node` into (unary
+    operators and + on constants, recursively), or not_constant."""
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and \
+            isinstance(node.op, (ast.USub, ast.Not)):
+        operand = folded(node.operand)
+        if operand is not_constant:
+            return operand
+        return -operand if isinstance(node.op, ast.USub) else not operand
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = folded(node.left), folded(node.right)
+        if left is not_constant or right is not_constant:
+            return not_constant
+        return left + right
+    return not_constant
+
+
+def assigned_names(body):
+    """Names bound by the statements of a function body,
+    not counting the bodies of nested functions."""
+    names = set()
+    stack = list(body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.Assign):
+            stack.extend(node.targets)
+        elif isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.List):
+            stack.extend(node.elts)
+        elif isinstance(node, ast.FunctionDef):
+            names.add(node.name)
+        elif isinstance(node, (ast.If, ast.While)):
+            stack.extend(node.body)
+            stack.extend(getattr(node, 'orelse', None) or [])
+    return names
+
+
+class Interpreter(object):
+    """Compiles a Module once; run() then executes it against an input.
+    An Interpreter must not be run from two threads at once."""
+
+    def __init__(self, tree):
+        self.globals = {}
+        self.builtins = {'print': self.print, 'input': self.input,
+                         'int': int}
+        self.depth = 0
+        self.code = self.block(tree.body, Scope())
+
+    def run(self, indata=None):
+        """Execute the program with `indata` as its stdin.
+        Returns (ok, stdout, error) like val.run_prog."""
+        self.globals.clear()
+        self.depth = 0
+        self.stdin = io.StringIO(indata or '')
+        self.out = io.StringIO()
+        limit = sys.getrecursionlimit()
+        # every program level call takes several interpreter frames
+        sys.setrecursionlimit(max(limit, max_depth * 50))
+        try:
+            self.code(Frame(self.globals, None))
+        except Exception as e:
+            return False, self.out.getvalue(), \
+                ''.join(traceback.format_exception_only(type(e), e))
+        finally:
+            sys.setrecursionlimit(limit)
+        return True, self.out.getvalue(), None
+
+    # builtins
+
+    def print(self, *args):
+        self.out.write(' '.join(map(str, args)) + '\n')
+
+    def input(self, prompt=''):
+        self.out.write(str(prompt))
+        line = self.stdin.readline()
+        if not line:
+            raise EOFError("EOF when reading a line")
+        return line[:-1] if line.endswith('\n') else line
+
+    # compilation
+
+    def compile(self, node, scope):
+        method = getattr(self, 'compile_' + type(node).__name__, None)
+        if method is None:
+            raise NotImplementedError(
+                "unsupported node {}".format(type(node).__name__))
+        return method(node, scope)
+
+    def block(self, body, scope):
+        stmts = tuple(self.compile(stmt, scope) for stmt in body)
+
+        def run(frame):
+            for stmt in stmts:
+                stmt(frame)
+        return run
+
+    def store(self, target, scope):
+        """Compile an assignment target into store(frame, value)."""
+        if isinstance(target, ast.Name):
+            name = target.id
+            if scope.resolve(name)[0] == 'local':
+                def store(frame, value):
+                    frame.vars[name] = value
+            else:
+                globals = self.globals
+
+                def store(frame, value):
+                    globals[name] = value
+            return store
+        if isinstance(target, ast.Subscript):
+            container = self.compile(target.value, scope)
+            index = self.compile(target.slice, scope)
+
+            def store(frame, value):
+                container(frame)[index(frame)] = value
+            return store
+        if isinstance(target, ast.List):
+            stores = tuple(self.store(elt, scope) for elt in target.elts)
+
+            def store(frame, value):
+                values = list(value)
+                if len(values) != len(stores):
+                    raise ValueError(
+                        "expected {} values to unpack, got {}"
+                        .format(len(stores), len(values)))
+                for store, value in zip(stores, values):
+                    store(frame, value)
+            return store
+        raise NotImplementedError(
+            "unsupported target {}".format(type(target).__name__))
+
+    # statements
+
+    def compile_Module(self, node, scope):
+        return self.block(node.body, scope)
+
+    def compile_Expr(self, node, scope):
+        return self.compile(node.value, scope)
+
+    def compile_Assign(self, node, scope):
+        value = self.compile(node.value, scope)
+        if len(node.targets) == 1:
+            store = self.store(node.targets[0], scope)
+
+            def assign(frame):
+                store(frame, value(frame))
+            return assign
+        # a = b = v, which only an ast.parse tree holds, stores v in
+        # every target from left to right
+        stores = [self.store(target, scope) for target in node.targets]
+
+        def assign_all(frame):
+            result = value(frame)
+            for store in stores:
+                store(frame, result)
+        return assign_all
+
+    def compile_If(self, node, scope):
+        test = self.compile(node.test, scope)
+        body = self.block(node.body, scope)
+        orelse = self.block(getattr(node, 'orelse', None) or [], scope)
+
+        def if_(frame):
+            if test(frame):
+                body(frame)
+            else:
+                orelse(frame)
+        return if_
+
+    def compile_While(self, node, scope):
+        test = self.compile(node.test, scope)
+        body = self.block(node.body, scope)
+
+        def while_(frame):
+            while test(frame):
+                body(frame)
+        return while_
+
+    def compile_Return(self, node, scope):
+        if scope.parent is None:
+            raise SyntaxError("'return' outside function")
+        if node.value is None:
+            def return_(frame):
+                raise ReturnValue(None)
+        else:
+            value = self.compile(node.value, scope)
+
+            def return_(frame):
+                raise ReturnValue(value(frame))
+        return return_
+
+    def compile_FunctionDef(self, node, scope):
+        params = tuple(a.arg for a in node.args.args)
+        inner = Scope(scope, set(params) | assigned_names(node.body))
+        body = self.block(node.body, inner)
+
+        def run(frame):
+            try:
+                body(frame)
+            except ReturnValue as r:
+                return r.value
+            return None
+        store = self.store(ast.Name(id=node.name), scope)
+        name = node.name
+
+        def define(frame):
+            store(frame, Function(name, params, run, frame, self))
+        return define
+
+    # expressions
+
+    def compile_Lambda(self, node, scope):
+        params = tuple(a.arg for a in node.args.args)
+        body = self.compile(node.body, Scope(scope, params))
+
+        def lambda_(frame):
+            return Function('<lambda>', params, body, frame, self)
+        return lambda_
+
+    def compile_Constant(self, node, scope):
+        value = scope.consts.setdefault(
+            (type(node.value), node.value), node.value)
+        return lambda frame: value
+
+    def compile_Name(self, node, scope):
+        name = node.id
+        kind, depth = scope.resolve(name)
+        if kind == 'local':
+            def load(frame):
+                try:
+                    return frame.vars[name]
+                except KeyError:
+                    raise UnboundLocalError(
+                        "cannot access local variable '{}' where it is"
+                        " not associated with a value".format(name)) from None
+        elif kind == 'free':
+            def load(frame):
+                for _ in range(depth):
+                    frame = frame.parent
+                try:
+                    return frame.vars[name]
+                except KeyError:
+                    raise NameError(
+                        "cannot access free variable '{}' where it is not"
+                        " associated with a value in enclosing scope"
+                        .format(name)) from None
+        else:
+            globals, builtins = self.globals, self.builtins
+
+            def load(frame):
+                try:
+                    return globals[name]
+                except KeyError:
+                    pass
+                try:
+                    return builtins[name]
+                except KeyError:
+                    raise NameError(
+                        "name '{}' is not defined".format(name)) from None
+        return load
+
+    def compile_Call(self, node, scope):
+        func = self.compile(node.func, scope)
+        args = tuple(self.compile(arg, scope) for arg in node.args)
+        return lambda frame: func(frame)(*[arg(frame) for arg in args])
+
+    def compile_BinOp(self, node, scope):
+        value = folded(node)
+        if value is not not_constant:
+            return self.compile_Constant(ast.Constant(value), scope)
+        if not isinstance(node.op, ast.Add):
+            raise NotImplementedError(
+                "unsupported operator {}".format(type(node.op).__name__))
+        left = self.compile(node.left, scope)
+        right = self.compile(node.right, scope)
+        return lambda frame: left(frame) + right(frame)
+
+    def compile_UnaryOp(self, node, scope):
+        value = folded(node)
+        if value is not not_constant:
+            return self.compile_Constant(ast.Constant(value), scope)
+        operand = self.compile(node.operand, scope)
+        if isinstance(node.op, ast.USub):
+            return lambda frame: -operand(frame)
+        if isinstance(node.op, ast.Not):
+            return lambda frame: not operand(frame)
+        raise NotImplementedError(
+            "unsupported operator {}".format(type(node.op).__name__))
+
+    def compile_BoolOp(self, node, scope):
+        values = tuple(self.compile(value, scope) for value in node.values)
+        if isinstance(node.op, ast.Or):
+            def or_(frame):
+                for value in values:
+                    result = value(frame)
+                    if result:
+                        return result
+                return result
+            return or_
+
+        def and_(frame):
+            for value in values:
+                result = value(frame)
+                if not result:
+                    return result
+            return result
+        return and_
+
+    def compile_Compare(self, node, scope):
+        left = self.compile(node.left, scope)
+        ops = tuple(compare_ops[type(op)] for op in node.ops)
+        comparators = tuple(self.compile(c, scope) for c in node.comparators)
+
+        def compare(frame):
+            value = left(frame)
+            for op, comparator in zip(ops, comparators):
+                right = comparator(frame)
+                result = op(value, right)
+                if not result:
+                    return result
+                value = right
+            return result
+        return compare
+
+    def compile_IfExp(self, node, scope):
+        test = self.compile(node.test, scope)
+        body = self.compile(node.body, scope)
+        orelse = self.compile(node.orelse, scope)
+        return lambda frame: body(frame) if test(frame) else orelse(frame)
+
+    def compile_List(self, node, scope):
+        elts = tuple(self.compile(elt, scope) for elt in node.elts)
+        return lambda frame: [elt(frame) for elt in elts]
+
+    def compile_Dict(self, node, scope):
+        items = tuple((self.compile(k, scope), self.compile(v, scope))
+                      for k, v in zip(node.keys, node.values))
+
+        def dict_(frame):
+            result = {}
+            for key, value in items:
+                k = key(frame)
+                result[k] = value(frame)
+            return result
+        return dict_
+
+    def compile_Subscript(self, node, scope):
+        value = self.compile(node.value, scope)
+        index = self.compile(node.slice, scope)
+        return lambda frame: value(frame)[index(frame)]
+
+
+def run(tree, indata=None):
+    """Compile and run a Module. Returns (ok, stdout, error)."""
+    try:
+        interp = Interpreter(tree)
+    except (SyntaxError, NotImplementedError) as e:
+        return False, '', '{}: {}'.format(type(e).__name__, e)
+    return interp.run(indata)
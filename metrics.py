@@ -0,0 +1,122 @@
+"""Validator metrics in the OpenMetrics text format, written to a
+textfile for the node-exporter textfile collector.
+
+Counters: files validated, valid files and failures by stage, each by
+subset, and cache hits and misses by cache. Histograms: the latency of
+the lex, parse, nodes and exec stages (lexing is part of the parse
+stage, and is also shown on its own). Recording a file only bumps a
+few counters; the file is rewritten (atomically) at most once per
+`interval` seconds and at the end of a run.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+import os
+import time
+
+# upper bounds of the latency buckets, in seconds
+buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+counter_help = {
+    'validator_files': 'Files validated.',
+    'validator_valid': 'Files found valid.',
+    'validator_failures': 'Files rejected, by the stage rejecting them.',
+    'validator_cache_hits': 'Cache lookups that hit.',
+    'validator_cache_misses': 'Cache lookups that missed.',
+}
+histogram_help = {
+    'validator_stage_seconds': 'Time spent in a validation stage.',
+}
+
+
+def labels_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels) + '}'
+
+
+class Metrics(object):
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.written = time.monotonic()
+        # (family, labels) -> value
+        self.counters = defaultdict(int)
+        # stage -> [per-bucket counts, sum, count]
+        self.latencies = {}
+
+    def inc(self, family, value=1, **labels):
+        self.counters[family, tuple(sorted(labels.items()))] += value
+
+    def set(self, family, value, **labels):
+        """Set a counter kept elsewhere, such as a cache's hit count."""
+        self.counters[family, tuple(sorted(labels.items()))] = value
+
+    def latency(self, stage, seconds):
+        entry = self.latencies.get(stage)
+        if entry is None:
+            entry = self.latencies[stage] = [[0] * (len(buckets) + 1),
+                                             0.0, 0]
+        entry[0][bisect_left(buckets, seconds)] += 1
+        entry[1] += seconds
+        entry[2] += 1
+
+    def record(self, subset, result):
+        """Count a validate_file or validate_matrix result."""
+        self.inc('validator_files', subset=subset.lower())
+        verdicts = result.get('subsets') or {subset.lower(): result}
+        for name, verdict in verdicts.items():
+            if verdict['valid']:
+                self.inc('validator_valid', subset=name)
+            else:
+                self.inc('validator_failures', subset=name,
+                         stage=verdict['stage'])
+        for stage, seconds in result['stages'].items():
+            self.latency(stage, seconds)
+        if 'lex' in result:
+            self.latency('lex', result['lex'])
+
+    def update(self):
+        """Write the textfile if the last write is `interval` old."""
+        if time.monotonic() - self.written >= self.interval:
+            self.write()
+
+    def render(self):
+        lines = []
+        families = defaultdict(list)
+        for (family, labels), value in sorted(self.counters.items()):
+            families[family].append((labels, value))
+        for family, samples in families.items():
+            lines.append('# TYPE {} counter'.format(family))
+            lines.append('# HELP {} {}'.format(family, counter_help[family]))
+            for labels, value in samples:
+                lines.append('{}_total{} {}'.format(
+                    family, labels_text(labels), value))
+        family = 'validator_stage_seconds'
+        if self.latencies:
+            lines.append('# TYPE {} histogram'.format(family))
+            lines.append('# HELP {} {}'.format(family,
+                                               histogram_help[family]))
+        for stage, (counts, total, count) in sorted(self.latencies.items()):
+            cumulative = 0
+            for bound, n in zip(buckets + ('+Inf',), counts):
+                cumulative += n
+                lines.append('{}_bucket{} {}'.format(family, labels_text(
+                    (('le', bound), ('stage', stage))), cumulative))
+            lines.append('{}_sum{} {}'.format(
+                family, labels_text((('stage', stage),)), round(total, 6)))
+            lines.append('{}_count{} {}'.format(
+                family, labels_text((('stage', stage),)), count))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, self.path)
+        self.written = time.monotonic()
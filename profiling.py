@@ -0,0 +1,149 @@
+"""Per-stage profiling of validation runs.
+
+Each validation stage of a sampled file runs under its own cProfile
+profiler. The raw stats travel back with the file's result (also from
+worker processes) and are added up per stage, then written as pstats
+files and as collapsed stacks ("a;b;c <microseconds>" lines) that
+flamegraph.pl, speedscope or inferno can read.
+
+cProfile records caller/callee edges rather than whole stacks, so the
+stacks are rebuilt from the call graph: a function's time is split
+between its callers in proportion to the time each edge accounts for.
+
+For memory profiling each stage runs under tracemalloc, started for
+the stage on its own, so the peak and the retained bytes count only
+what the stage allocated.
+"""
+
+from collections import Counter, defaultdict
+import cProfile
+import hashlib
+import os
+import pstats
+import tracemalloc
+
+# stacks are cut at this depth, and paths worth less are dropped
+max_stack_depth = 64
+min_stack_seconds = 1e-6
+# allocation sites reported per stage
+top_sites = 5
+
+
+def sampled(file, rate):
+    """Whether `file` is profiled at sampling `rate` (0 to 1). The
+    choice depends only on the name, so every run and every shard
+    profiles the same files."""
+    if rate >= 1:
+        return True
+    digest = hashlib.blake2b(file.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') < rate * 2 ** 64
+
+
+def profile_call(func, *args):
+    """Call func(*args) under cProfile. Returns its result and the
+    raw stats, a picklable dict."""
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args)
+    profiler.create_stats()
+    return result, profiler.stats
+
+
+def memprofile_call(func, *args, lines=1):
+    """Call func(*args) under tracemalloc. Returns its result and the
+    stage's memory: `peak` and `retained` bytes, both also per source
+    line of the program (`lines`), and the `sites` retaining most."""
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        retained, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__),
+             tracemalloc.Filter(False, cProfile.__file__),
+             tracemalloc.Filter(False, __file__)])
+    finally:
+        tracemalloc.stop()
+    sites = [{'site': '{}:{}'.format(os.path.basename(stat.traceback[0]
+                                                      .filename),
+                                     stat.traceback[0].lineno),
+              'bytes': stat.size,
+              'count': stat.count}
+             for stat in snapshot.statistics('lineno')[:top_sites]]
+    return result, {'peak': peak,
+                    'retained': retained,
+                    'peak_per_line': round(peak / lines, 1),
+                    'retained_per_line': round(retained / lines, 1),
+                    'sites': sites}
+
+
+class RawStats(object):
+    """Lets pstats.Stats load a raw stats dict."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def aggregate(results):
+    """Add up the `profile` of results per stage, removing it from
+    them. Returns {stage: pstats.Stats}."""
+    stages = {}
+    for result in results:
+        for stage, stats in result.pop('profile', {}).items():
+            if stage in stages:
+                stages[stage].add(RawStats(stats))
+            else:
+                stages[stage] = pstats.Stats(RawStats(stats))
+    return stages
+
+
+def label(func):
+    file, line, name = func
+    if file == '~':  # builtins
+        return name.replace(';', ':')
+    return '{} ({}:{})'.format(name, os.path.basename(file),
+                               line).replace(';', ':')
+
+
+def collapsed_stacks(stats):
+    """Collapsed stacks of a pstats.Stats, as {stack: seconds}."""
+    stats = stats.stats
+    children = defaultdict(dict)
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            children[caller][func] = edge[3]
+    stacks = Counter()
+    todo = [(func, (), 1.0) for func, entry in stats.items() if not entry[4]]
+    while todo:
+        func, path, share = todo.pop()
+        path = path + (func,)
+        stacks[';'.join(label(f) for f in path)] += stats[func][2] * share
+        if len(path) >= max_stack_depth:
+            continue
+        for child, edge_time in children[func].items():
+            child_time = stats[child][3]
+            if child in path or child_time <= 0:
+                continue
+            child_share = share * min(edge_time / child_time, 1.0)
+            if child_time * child_share >= min_stack_seconds:
+                todo.append((child, path, child_share))
+    return stacks
+
+
+def write_profiles(prefix, stages):
+    """Write <prefix>.<stage>.pstats and <prefix>.<stage>.collapsed
+    for every stage. Returns the paths written."""
+    paths = []
+    for stage, stats in sorted(stages.items()):
+        path = '{}.{}.pstats'.format(prefix, stage)
+        stats.dump_stats(path)
+        paths.append(path)
+        path = '{}.{}.collapsed'.format(prefix, stage)
+        with open(path, 'w') as f:
+            for stack, seconds in sorted(collapsed_stacks(stats).items()):
+                micros = int(round(seconds * 1e6))
+                if micros:
+                    f.write('{} {}\n'.format(stack, micros))
+        paths.append(path)
+    return paths
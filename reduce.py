@@ -0,0 +1,356 @@
+"""Delta-debugging reducer for failing test programs.
+
+Shrinks a program that fails validation (or, with --compiler-cmd, that
+the compiler gets wrong) while it keeps failing the same way: at the
+same stage, with the same kind of error. Statements, expressions and
+function bodies are removed or simplified along the tree the ply parser
+builds, and every candidate is printed back to source with ast.unparse.
+A program the ply parser rejects is reduced line by line instead.
+
+Every candidate is checked in this process, with one warm lexer and
+parser and the built-in interpreter, so a step takes milliseconds; only
+a compiler runs in child processes.
+
+Usage: python3 reduce.py --subset=<python-subset> \
+                         --input=<file> [--output=<file>] \
+                         [--match=<regex>] [--timeout=<seconds>] \
+                         [--compiler-cmd=<cmd> [--build-cmd=<cmd>] \
+                          [--run-cmd=<cmd>]] [--verbose]
+
+Example: python3 reduce.py --subset=P2 --input=tests/p2err.py \
+                           --output=p2err.min.py
+"""
+
+import argparse
+import ast
+import os
+import re
+import signal
+import sys
+import time
+from val import *
+from compiler import Pipeline, Toolchain
+
+# kinds of failure, most specific first; two failures are the same if
+# they happen at the same stage and the first kind matching is the same
+failure_kinds = [
+    # a subset error, told apart by the left-hand side of the production
+    r'"\w+ ->(?=[^"]*" is not part of P\d)',
+    r'Unknown Symbol',
+    r'Indentation error',
+    r'Syntax error',
+    r'invalid AST node',
+    r'stdout differs',
+    r'exit status -?\d+',
+    r'timed out',
+    r'\w+(?:Error|Exception)\b',
+]
+
+# list fields whose items may be dropped
+reducible_lists = ('body', 'orelse', 'elts', 'args')
+# fields that are never replaced by a simpler expression
+fixed_fields = ('func', 'targets', 'ctx')
+# fields ply leaves out of its nodes that ast.unparse reads
+list_fields = ('type_ignores', 'posonlyargs', 'kwonlyargs', 'kw_defaults',
+               'defaults', 'decorator_list', 'keywords', 'orelse')
+
+
+def failure_kind(error):
+    for kind in failure_kinds:
+        match = re.search(kind, error)
+        if match:
+            return match.group()
+    return error
+
+
+def unparse(tree):
+    """Source of a ply tree."""
+    for node in ast.walk(tree):
+        for field in node._fields + node._attributes:
+            if not hasattr(node, field):
+                setattr(node, field, [] if field in list_fields else None)
+    return ast.unparse(tree) + '\n'
+
+
+def alarm(signum, frame):
+    raise TimeoutError('program timed out')
+
+
+class Checker(object):
+    """Tells how a program fails, with the stage checks of validate_file
+    run in this process. A program is interrupted after `timeout`
+    seconds in the interpreter, by default ten times as long as the
+    first program took (from 0.1 up to 1s). Verdicts are cached by
+    source."""
+
+    def __init__(self, subset, indata=None, timeout=None, pipeline=None):
+        self.subset = subset
+        self.indata = indata
+        self.timeout = timeout
+        self.pipeline = pipeline
+        self.lexer = Lexer()
+        self.parser = Parser(subset)
+        self.cache = {}
+        # interpreter runs of the programs checked, for reference()
+        self.runs = {}
+        self.checks = 0
+        self.elapsed = 0.0
+
+    def parse(self, code):
+        tokens = tokenize(code + '\n', self.lexer)
+        return self.parser.parse(code, TokenReplay(tokens), self.subset)
+
+    def run(self, code, indata=None):
+        """Run a program in the interpreter: (ok, stdout, error)."""
+        tree = self.parse(code)
+        start = time.perf_counter()
+        signal.signal(signal.SIGALRM, alarm)
+        signal.setitimer(signal.ITIMER_REAL, self.timeout or 1.0)
+        try:
+            return interp.run(tree, indata)
+        except TimeoutError as e:
+            return False, '', '{}: {}'.format(type(e).__name__, e)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            # every candidate that loops forever costs a timeout
+            if self.timeout is None:
+                self.timeout = min(max(
+                    10 * (time.perf_counter() - start), 0.1), 1.0)
+
+    def failure(self, code):
+        """(stage, error) of the first stage `code` fails, or None."""
+        if code not in self.cache:
+            start = time.perf_counter()
+            self.cache[code] = self.check(code)
+            self.elapsed += time.perf_counter() - start
+            self.checks += 1
+        return self.cache[code]
+
+    def reference(self, code, indata):
+        """The interpreter run of a checked program, for a Pipeline
+        to compare the compiled program's with."""
+        return self.runs[code]
+
+    def check(self, code):
+        job = {'subset': self.subset, 'code': code, 'error': None}
+        if not stage_nodes(job):
+            return 'nodes', job['error']
+        try:
+            self.parse(code)
+        except ValidationError as e:
+            return 'parse', str(e)
+        ok, out, err = self.runs[code] = self.run(code, self.indata)
+        if not ok:
+            return 'exec', err
+        if self.pipeline:
+            verdict = self.pipeline.submit('reduce.py', code, self.indata,
+                                           on_disk=False,
+                                           expected=self.runs[code]).result()
+            if not verdict['valid']:
+                return verdict['stage'], verdict['error']
+        return None
+
+
+def ddmin(items, test, keep=0):
+    """Drop chunks of `items` for as long as test(remaining items)
+    holds, halving the chunk size down to single items. At least
+    `keep` items are left."""
+    chunk = len(items)
+    while chunk:
+        start = 0
+        while start < len(items):
+            candidate = items[:start] + items[start + chunk:]
+            if len(candidate) >= keep and test(candidate):
+                items = candidate
+            else:
+                start += chunk
+        chunk //= 2
+    return items
+
+
+def walk(tree):
+    """Nodes of `tree` in preorder. A node's children are looked up
+    only after it has been handled, so nodes removed meanwhile are
+    skipped."""
+    todo = [tree]
+    while todo:
+        node = todo.pop()
+        yield node
+        todo.extend(reversed(list(ast.iter_child_nodes(node))))
+
+
+def simpler_statements(stmt):
+    """Statement lists to try in place of `stmt`."""
+    if isinstance(stmt, (ast.If, ast.While)):
+        yield stmt.body
+    if isinstance(stmt, ast.If) and stmt.orelse:
+        yield stmt.orelse
+    if isinstance(stmt, ast.FunctionDef) and not (
+            len(stmt.body) == 1 and isinstance(stmt.body[0], ast.Return)
+            and isinstance(stmt.body[0].value, ast.Constant)):
+        yield [ast.FunctionDef(name=stmt.name, args=stmt.args,
+                               body=[ast.Return(value=ast.Constant(0))])]
+
+
+def simpler_expressions(expr):
+    """Expressions to try in place of `expr`: its own subexpressions,
+    then the constant 0."""
+    for child in ast.iter_child_nodes(expr):
+        if isinstance(child, ast.expr):
+            yield child
+    if not (isinstance(expr, ast.Constant) and expr.value == 0):
+        yield ast.Constant(0)
+
+
+def reduce_tree(tree, test):
+    """Shrink `tree` in place for as long as test(tree) holds, until
+    a whole pass over it changes nothing."""
+    source = None
+    while source != unparse(tree):
+        source = unparse(tree)
+        for node in walk(tree):
+            for field, value in list(ast.iter_fields(node)):
+                if field in reducible_lists and isinstance(value, list) \
+                        and value and isinstance(value[0], ast.AST):
+                    reduce_list(tree, node, field, test)
+                elif field not in fixed_fields and \
+                        isinstance(value, ast.expr):
+                    for expr in simpler_expressions(value):
+                        setattr(node, field, expr)
+                        if test(tree):
+                            break
+                    else:
+                        setattr(node, field, value)
+
+
+def reduce_list(tree, node, field, test):
+    """Drop items of the list `field` of `node`, then simplify the
+    items left in it."""
+    # a block needs a statement, only the module may be empty
+    keep = 1 if field == 'body' and not isinstance(node, ast.Module) else 0
+
+    def test_items(items):
+        setattr(node, field, items)
+        return test(tree)
+    items = ddmin(getattr(node, field), test_items, keep)
+    index = 0
+    while index < len(items):
+        item = items[index]
+        if isinstance(item, ast.stmt):
+            replacements = simpler_statements(item)
+        else:
+            replacements = ([expr] for expr in simpler_expressions(item))
+        for replacement in replacements:
+            candidate = items[:index] + replacement + items[index + 1:]
+            if test_items(candidate):
+                items = candidate
+                break
+        index += 1
+    setattr(node, field, items)
+
+
+def reduce_program(code, checker, match=None):
+    """The smallest program found that fails as `code` does, or None if
+    `code` does not fail. With `match`, any failure whose error matches
+    that regex will do."""
+    failure = checker.failure(code)
+    if failure is None:
+        return None
+    stage, error = failure
+
+    def interesting(source):
+        failure = checker.failure(source)
+        if failure is None:
+            return False
+        if match:
+            return re.search(match, failure[1]) is not None
+        return failure[0] == stage and \
+            failure_kind(failure[1]) == failure_kind(error)
+
+    try:
+        tree = checker.parse(code)
+    except ValidationError:
+        tree = None
+    if tree is not None and interesting(unparse(tree)):
+        reduce_tree(tree, lambda tree: interesting(unparse(tree)))
+        return unparse(tree)
+    lines = ddmin(code.splitlines(True), lambda lines:
+                  interesting(''.join(lines)))
+    return ''.join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Shrink a failing test program, keeping its failure")
+    parser.add_argument(
+        "--subset", help="python subset to check with", required=True)
+    parser.add_argument(
+        "--input", help="failing program", required=True)
+    parser.add_argument(
+        "--output", help="where to write the reduced program "
+        "(and its stdin), instead of printing it")
+    parser.add_argument(
+        "--match", help="keep any failure whose error matches this regex, "
+        "rather than the same kind of failure at the same stage")
+    parser.add_argument(
+        "--timeout", help="seconds a candidate may run in the interpreter "
+        "(default: ten times the input's run, from 0.1 up to 1)",
+        type=float)
+    parser.add_argument(
+        "--compiler-cmd", help="also fail programs the compiler gets "
+        "wrong (see val.py --compiler-cmd)")
+    parser.add_argument(
+        "--build-cmd", help="command building the compiler's output")
+    parser.add_argument(
+        "--run-cmd", help="command running the executable",
+        default='{exe}')
+    parser.add_argument(
+        "--verbose", help="print the error of the reduced program",
+        action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not is_valid_subset(args.subset):
+        exit(1)
+    with open(args.input, 'r') as f:
+        code = f.read()
+    indata = read_input(args.input)
+    pipeline = None
+    checker = Checker(args.subset, indata, args.timeout)
+    if args.compiler_cmd:
+        pipeline = Pipeline(Toolchain(args.compiler_cmd, args.build_cmd,
+                                      args.run_cmd),
+                            checker.reference, workers=1)
+        checker.pipeline = pipeline
+    try:
+        reduced = reduce_program(code, checker, args.match)
+    finally:
+        if pipeline:
+            pipeline.close()
+    if reduced is None:
+        print('{}: does not fail at {}'.format(args.input,
+                                              args.subset.upper()))
+        exit(1)
+    stage, error = checker.failure(reduced)
+    if args.verbose:
+        print(error, file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(reduced)
+        if indata is not None:
+            with open(os.path.splitext(args.output)[0] + '.in', 'w') as f:
+                f.write(indata)
+    else:
+        sys.stdout.write(reduced)
+    print('{}: {} stage failure reduced from {} to {} lines; {} checks, '
+          '{:.2f}ms each'.format(args.input, stage,
+                                 len(code.splitlines()),
+                                 len(reduced.splitlines()), checker.checks,
+                                 1000 * checker.elapsed / checker.checks),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Structured validation reports, and merging of the partial reports
+written by the shards of a run into one.
+
+A report is a JSON object:
+    {"subset": "p1", "shard": [1, 4],
+     "results": [{"file": "t.py", "valid": true, "stage": null,
+                  "error": null, "time": 0.02,
+                  "stages": {"parse": 0.001, "nodes": 0.001, "exec": 0.018},
+                  "rusage": {"wall": 0.018, "utime": 0.012, "stime": 0.004,
+                             "maxrss": 9216, "nvcsw": 1, "nivcsw": 0},
+                  "regressed": false}, ...],
+     "skipped": [],
+     "summary": {"files": 1, "valid": 1, "invalid": 0, "skipped": 0,
+                 "regressed": 0, "time": 0.02, "rusage": {...}}}
+
+`skipped` lists the files a --fail-fast run has no result for: files it
+cancelled, killed while they ran, or that finished after it stopped.
+
+With --interpreters, `interpreters` holds the verdict of every
+interpreter a program ran under: whether it was `ok`, its exit
+`status`, whether its status or stdout `diverged` from the first
+interpreter's, the last line of its `error` and its `wall` time. The
+summary counts the files diverging under each interpreter.
+
+With --memprofile, `memory` holds for every stage the `peak` and
+`retained` bytes, both per source line too, and the allocation `sites`
+retaining most; the summary gives the largest peak of each stage with
+its file.
+
+`rusage` is the resource usage of the child process that executed the
+program (CPU and wall seconds, max RSS in KiB, voluntary and involuntary
+context switches). The summary adds it up over all results, except for
+`maxrss`, which is the largest of any test along with its `maxrss_file`.
+
+Usage: python3 report.py merge --output=<file> <report> [<report> ...]
+
+Example: python3 report.py merge --output=all.json shard-*.json
+"""
+
+import argparse
+import json
+
+
+def summarize_rusage(results):
+    usages = [(result['file'], result['rusage']) for result in results
+              if result.get('rusage')]
+    if not usages:
+        return None
+    summary = {'tests': len(usages)}
+    for field in ('wall', 'utime', 'stime', 'nvcsw', 'nivcsw'):
+        summary[field] = round(sum(usage[field] for _, usage in usages), 6)
+    summary['maxrss_file'], top = max(usages, key=lambda u: u[1]['maxrss'])
+    summary['maxrss'] = top['maxrss']
+    return summary
+
+
+def summarize_memory(results):
+    stages = {}
+    for result in results:
+        for stage, memory in result.get('memory', {}).items():
+            top = stages.get(stage)
+            if top is None or memory['peak'] > top['peak']:
+                stages[stage] = {'peak': memory['peak'],
+                                 'peak_per_line': memory['peak_per_line'],
+                                 'peak_file': result['file']}
+    return stages or None
+
+
+def summarize_interpreters(results):
+    """Files whose run under each interpreter diverged from the first's."""
+    diverged = {}
+    for result in results:
+        for interpreter, verdict in result.get('interpreters', {}).items():
+            diverged[interpreter] = diverged.get(interpreter, 0) + \
+                verdict['diverged']
+    return diverged or None
+
+
+def summarize(results, skipped=()):
+    valid = sum(1 for result in results if result['valid'])
+    return {'files': len(results),
+            'valid': valid,
+            'invalid': len(results) - valid,
+            'skipped': len(skipped),
+            'regressed': sum(1 for result in results
+                             if result.get('regressed')),
+            'time': round(sum(result['time'] for result in results), 6),
+            'rusage': summarize_rusage(results),
+            'memory': summarize_memory(results),
+            'interpreters': summarize_interpreters(results)}
+
+
+def make_report(subset, results, shard=None, skipped=()):
+    return {'subset': subset.lower(),
+            'shard': list(shard) if shard else None,
+            'results': results,
+            'skipped': sorted(skipped),
+            'summary': summarize(results, skipped)}
+
+
+def write_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+        f.write('\n')
+
+
+def load_report(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def durations(report):
+    """Per-file validation time recorded in a report."""
+    return {result['file']: result['time'] for result in report['results']}
+
+
+def merge(reports):
+    """Combine partial reports into one. Raises ValueError when they
+    are for different subsets, overlap, or miss some of the shards."""
+    subsets = {report['subset'] for report in reports}
+    if len(subsets) != 1:
+        raise ValueError("reports for different subsets: {}"
+                         .format(sorted(subsets)))
+    shards = [tuple(report['shard']) for report in reports
+              if report['shard']]
+    if shards:
+        counts = {count for _, count in shards}
+        if len(counts) != 1:
+            raise ValueError("reports from different shardings: {}"
+                             .format(sorted(counts)))
+        count = counts.pop()
+        missing = set(range(1, count + 1)) - {index for index, _ in shards}
+        if missing or len(shards) != len(reports):
+            raise ValueError("missing shards: {}".format(sorted(missing)))
+    results = []
+    skipped = []
+    seen = set()
+    for report in reports:
+        skipped += report.get('skipped', [])
+        for result in report['results']:
+            if result['file'] in seen:
+                raise ValueError("{} is in more than one report"
+                                 .format(result['file']))
+            seen.add(result['file'])
+            results.append(result)
+    results.sort(key=lambda result: result['file'])
+    return make_report(subsets.pop(), results, skipped=skipped)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Validation reports")
+    sub = parser.add_subparsers(dest="command", required=True)
+    merge = sub.add_parser("merge", help="merge partial reports")
+    merge.add_argument(
+        "--output", help="merged report to write", required=True)
+    merge.add_argument(
+        "reports", help="partial reports", nargs="+")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "merge":
+        try:
+            report = merge([load_report(path) for path in args.reports])
+        except ValueError as e:
+            print(e)
+            exit(1)
+        write_report(args.output, report)
+        summary = report['summary']
+        print('{files} files, {valid} valid, {invalid} invalid'
+              .format(**summary))
+        for result in report['results']:
+            if not result['valid']:
+                print('invalid ({}): {}'.format(result['stage'],
+                                                result['file']))
+        exit(1 if summary['invalid'] else 0)
+
+
+if __name__ == "__main__":
+    main()
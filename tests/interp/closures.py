@@ -0,0 +1,26 @@
+def make_adder(n):
+    return lambda x: x + n
+add2 = make_adder(2)
+add5 = make_adder(5)
+print(add2(1), add5(1), make_adder(-1)(1))
+def counter():
+    c = [0]
+    def inc():
+        c[0] = c[0] + 1
+        return c[0]
+    return inc
+k = counter()
+k()
+j = counter()
+print(k(), k(), j())
+def outer():
+    def inner():
+        return y
+    y = 3
+    return inner
+print(outer()())
+def shadow(x):
+    def inner(x):
+        return x + 1
+    return inner(x + 10)
+print(shadow(1))
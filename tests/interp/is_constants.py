@@ -0,0 +1,23 @@
+x = -1000
+y = -1000
+print(x is y)
+a = 999 + 1
+b = 1000
+print(a is b)
+c = -(-1000)
+p = 300
+q = 300
+print(c is b, p is q, -p is -q)
+def f():
+    return 1000
+print(f() is b, f() is f())
+g = lambda: 999 + 1
+print(g() is f(), g() is g())
+n = int(input())
+print(n + 1 is n + 1, n is n)
+l = [1]
+m = l
+print(l is m, l is [1], l == [1])
+t = True
+u = -1
+print(t is True, not t is False, -t is u)
@@ -0,0 +1,16 @@
+fs = []
+i = 0
+while i != 3:
+    fs = fs + [lambda d: i + d]
+    i = i + 1
+print(fs[0](0), fs[1](0), fs[2](0))
+def g():
+    return z
+z = 1
+print(g())
+z = 2
+print(g())
+def h(v):
+    return lambda: v
+hs = [h(0), h(1)]
+print(hs[0](), hs[1]())
@@ -0,0 +1,7 @@
+x = 1
+def f():
+    y = x
+    x = 2
+    return y
+print(x)
+print(f())
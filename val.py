@@ -14,7 +14,7 @@ Usage: python3 val.py --subset=<python-subset> \
 Example: python3 val.py --subset=P0 --input=test.py
 """
 
-from collections import deque
+from collections import deque, OrderedDict
 from pathlib import Path
 from inspect import currentframe, getframeinfo
 from tabnanny import verbose
@@ -22,13 +22,44 @@ import ply.yacc as yacc
 import ply.lex as lex
 import ast
 from ast import *
+import shutil
 import subprocess
+import signal
+import tempfile
 import argparse
 import os
+import copy
+import types
+import threading
+import sys
+import io
+import traceback
+import hashlib
+import importlib.util
+import marshal
+import multiprocessing
+import re
+import time
 from grammar import *
+import interp
+import report
+from history import History, longest_first, regressed
+from archive import Archive, is_archive
+from corpus import SharedCorpus
+from metrics import Metrics
+from compiler import Pipeline, Toolchain
+from profiling import (profile_call, memprofile_call, sampled, aggregate,
+                       write_profiles)
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
 
 subset_tbl = ['p0', 'p1', 'p2', 'p3']
+# replaced by print in main() when --verbose is given
+verboseprint = lambda *a, **k: None
 python_exe = 'python3'
+# set by --interpreters: the python3 executor then runs every program
+# under each of them, the first being the reference
+interpreters = None
 nodes = [
     [Module, Assign, Name,
      Constant, Expr, Call,
@@ -43,6 +74,11 @@ nodes = [
     [If, While, ClassDef]  # < P3
 ]
 
+class ValidationError(Exception):
+    """Raised by the lexer and parser when a program is rejected, so a
+    batch or a long-running validator can carry on with the next one."""
+
+
 def get_fileinfo():
     """Get the file name, function name and 
     line number of the current frame."""
@@ -53,18 +89,61 @@ def get_fileinfo():
     return Path(filename).stem, funcname, lineno
 
 
-def popen_result(popen):
+class RusagePopen(subprocess.Popen):
+    """Popen that reaps its child with wait4, keeping the child's
+    resource usage and the wall time from start to exit.
+
+    Only the public wait() is overridden: communicate() ends with a
+    blocking wait(), which reaps the child here once its pipes are
+    closed. A child reaped any other way (poll(), or wait() with a
+    timeout) has no resource usage, and usage() is empty."""
+
+    def __init__(self, *args, **kwargs):
+        self.rusage = None
+        self.wall = None
+        self.started = time.perf_counter()
+        super().__init__(*args, **kwargs)
+
+    def wait(self, timeout=None):
+        if self.returncode is None and timeout is None:
+            try:
+                (pid, sts, rusage) = os.wait4(self.pid, 0)
+            except ChildProcessError:
+                pass  # already reaped; wait() below settles it
+            else:
+                self.rusage = rusage
+                self.wall = time.perf_counter() - self.started
+                self.returncode = os.waitstatus_to_exitcode(sts)
+        return super().wait(timeout)
+
+    def usage(self):
+        """The resource usage of the exited child: `wall`, user and
+        system CPU seconds (`utime`, `stime`), max RSS in KiB (`maxrss`)
+        and voluntary/involuntary context switches (`nvcsw`, `nivcsw`)."""
+        if self.rusage is None:
+            return {}
+        return {'wall': round(self.wall, 6),
+                'utime': round(self.rusage.ru_utime, 6),
+                'stime': round(self.rusage.ru_stime, 6),
+                'maxrss': self.rusage.ru_maxrss,
+                'nvcsw': self.rusage.ru_nvcsw,
+                'nivcsw': self.rusage.ru_nivcsw}
+
+
+def popen_result(popen, usage=None):
+    """Wait for a program run by exec_prog. Returns (ok, error, stdout),
+    the error being the program's stderr or its exit status."""
     (out, err) = popen.communicate()
     verboseprint(get_fileinfo(), out, err)
     retcode = popen.wait()
+    if usage is not None and isinstance(popen, RusagePopen):
+        usage.update(popen.usage())
     if retcode != 0:
         if not (out is None):
             verboseprint(out)
-        return False
-    elif err:  # stderr is not empty or None
-        return False
-    else:
-        return True
+        return False, err.strip() or 'exit status {}'.format(retcode), out
+    # warnings on stderr do not fail the run
+    return True, None, out
 
 def validate(subset_func):
     """Decorator to get valid nodes from subset func, 
@@ -124,6 +203,16 @@ def traverse(subset, f):
 # Ply parser
 ##########################
 
+def expression_value(exprs):
+    """The value of an expression_list where a single expression is
+    expected: the expression itself, a Tuple of several, None if empty."""
+    if not exprs:
+        return None
+    if len(exprs) == 1:
+        return exprs[0]
+    return Tuple(elts=exprs, ctx=Load())
+
+
 class Lexer:
     reserved = {
         'if': 'IF',
@@ -187,12 +276,47 @@ class Lexer:
     def __init__(self):
         self.lexer = lex.lex(module=self)
         self.lexer.begin('INITIAL')
+        self.input('')
 
     def input(self, data):
-        self.lexer.input(data)
+        self.data = data
+        self.pos = 0
 
     def token(self):
-        return self.lexer.token()
+        """Return the next token, or None at the end of the input.
+        Scans with the master regex ply built from the t_ rules, the
+        way ply's own Lexer.token does, but produces slotted Tokens."""
+        data = self.data
+        pos = self.pos
+        end = len(data)
+        ignore = self.lexer.lexignore
+        while pos < end:
+            if data[pos] in ignore:
+                pos += 1
+                continue
+            for lexre, lexindexfunc in self.lexer.lexre:
+                m = lexre.match(data, pos)
+                if m:
+                    break
+            else:
+                self.pos = pos
+                self.t_error(Token('error', data[pos:], 1, pos))
+            func, type = lexindexfunc[m.lastindex]
+            pos = m.end()
+            if type is None:  # t_ignore_ rules
+                continue
+            tok = Token(type, m.group(), 1, m.start())
+            self.pos = pos
+            if func is not None:
+                tok = func(tok)
+                if tok is None:
+                    # a rule returning None discards the token, and may
+                    # have moved pos; ply then scans on from there
+                    pos = self.pos
+                    continue
+            return tok
+        self.pos = pos
+        return None
 
     def t_identifier(self, t):
         r'[a-zA-Z_][a-zA-Z_0-9]*'
@@ -215,27 +339,42 @@ class Lexer:
         return t
 
     def t_error(self, t):
-        verboseprint(get_fileinfo(), "Unknown Symbol '{}'".format(t.value[0]))
-        exit(1)
+        raise ValidationError("{} Unknown Symbol '{}'".format(
+            get_fileinfo(), t.value[0]))
 
 
-def _new_token(type):
-    """Create a new token with the given type. Useful
-    for creating indent/dedent tokens dynamically."""
-    tok = lex.LexToken()
-    tok.type = type
-    tok.value = None
-    tok.lineno = -1
-    tok.lexpos = -1
-    return tok
+class Token(object):
+    """A token of the input. Slotted rather than dict-backed
+    like ply's LexToken, which it otherwise stands in for."""
+    __slots__ = ('type', 'value', 'lineno', 'lexpos', 'lexer')
 
+    def __init__(self, type, value, lineno=-1, lexpos=-1):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+        self.lexer = None
 
-def DEDENT():
-    return _new_token("DEDENT")
+    def __repr__(self):
+        return 'LexToken({},{!r},{},{})'.format(
+            self.type, self.value, self.lineno, self.lexpos)
 
 
-def INDENT():
-    return _new_token("INDENT")
+class StructuralToken(Token):
+    """An INDENT or DEDENT token. These carry no value or position, so
+    one immutable instance of each is shared by every token stream."""
+    __slots__ = ()
+
+    def __init__(self, type):
+        for name, value in zip(Token.__slots__, (type, None, -1, -1, None)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} tokens are immutable".format(self.type))
+
+
+INDENT = StructuralToken("INDENT")
+DEDENT = StructuralToken("DEDENT")
 
 
 class IndentWrapper(object):
@@ -260,20 +399,19 @@ class IndentWrapper(object):
         if t is None:
             self.eof_reached = True
             if len(self.indent_stack) > 1:
-                t = DEDENT()
-                for i in range(len(self.indent_stack) - 1):
-                    self.token_queue.append(DEDENT())
+                t = DEDENT
+                self.token_queue.extend([DEDENT] * (len(self.indent_stack) - 1))
                 self.indent_stack = [0]
         elif t.type == "NEWLINE":
             if t.value > self.indent_stack[-1]:
                 self.indent_stack.append(t.value)
-                self.token_queue.append(INDENT())
+                self.token_queue.append(INDENT)
             else:
                 while t.value < self.indent_stack[-1]:
                     self.indent_stack.pop()
-                    self.token_queue.append(DEDENT())
+                    self.token_queue.append(DEDENT)
                 if t.value != self.indent_stack[-1]:
-                    raise Exception("Indentation error")
+                    raise ValidationError("Indentation error")
         return t
 
 
@@ -289,17 +427,49 @@ class Parser(object):
         ('right', 'UMINUS'),
     )
 
-    def __init__(self, subset):
-        # get all the function names 
-        # in this class starting with p_
-        self.functions = [getattr(Parser, f) for f in dir(self) if f.startswith('p_')]
-        for fattr in grammar[subset]:
-            for f in self.functions:
-                if f.__name__ == fattr[0]:
-                    f.__doc__ = fattr[1]
-        self.parser = yacc.yacc(module=self)
-
-    def parse(self, data, lexer):
+    def __init__(self, subset='p3', coverage=False):
+        # the table is shared by every parser in the process, the
+        # parse state and the production actions are per instance
+        self.coverage = coverage
+        # productions reduced by the last parse, if coverage is on
+        self.hits = set()
+        self.parser = copy.copy(parse_table())
+        self.parser.errorfunc = self.p_error
+        self.parser.productions = [self.bind(prod)
+                                   for prod in self.parser.productions]
+        self.level = subset_tbl.index(subset.lower())
+
+    def bind(self, prod):
+        """Bind a production of the shared table to this parser's action.
+        Productions that are not part of P0 are wrapped with a check
+        against the subset currently being parsed."""
+        prod = copy.copy(prod)
+        if prod.func:
+            prod.callable = getattr(self, prod.func)
+            level = grammar_levels.get(prod.str, 0)
+            if level:
+                prod.callable = self.gate(prod.str, level, prod.callable)
+            if self.coverage:
+                prod.callable = self.record(prod.str, prod.callable)
+        return prod
+
+    def record(self, name, action):
+        def recorded(p):
+            action(p)
+            self.hits.add(name)
+        return recorded
+
+    def gate(self, name, level, action):
+        def gated(p):
+            if self.level < level:
+                self.subset_error(name)
+            action(p)
+        return gated
+
+    def parse(self, data, lexer, subset=None):
+        if subset is not None:
+            self.level = subset_tbl.index(subset.lower())
+        self.hits = set()
         return self.parser.parse(data, lexer=lexer)
 
     def p_module(self, p):
@@ -337,10 +507,15 @@ class Parser(object):
         p[0] = [p[1]]
 
     def p_target(self, p):
-        if len(p) == 2:
+        if p.slice[1].type == "identifier":
             p[0] = Name(id=p[1], ctx=Store())
+        elif p.slice[1].type == "subscription":
+            p[0] = p[1]
+            p[0].ctx = Store()
+        elif p.slice[1].type == "LPAREN":
+            p[0] = p[2][0]
         else:
-            p[0] = p[2]
+            p[0] = List(elts=p[2], ctx=Store())
 
     def p_atom(self, p):
         if p.slice[1].type == "identifier":
@@ -349,7 +524,10 @@ class Parser(object):
             p[0] = p[1]
 
     def p_literal(self, p):
-        p[0] = Constant(value=p[1])
+        if p.slice[1].type == "integer":
+            p[0] = Constant(value=p[1])
+        else:
+            p[0] = Constant(value=p[1] == "True")
 
     def p_enclosure(self, p):
         p[0] = p[1]
@@ -378,7 +556,7 @@ class Parser(object):
         p[0] = (p[1], p[3])
 
     def p_subscription(self, p):
-        p[0] = Subscript(value=p[1], slice=p[3])
+        p[0] = Subscript(value=p[1], slice=expression_value(p[3]), ctx=Load())
 
     def p_primary(self, p):
         p[0] = p[1]
@@ -411,7 +589,7 @@ class Parser(object):
         if len(p) == 2:
             p[0] = p[1]
         else:
-            p[0] = IfExp(test=p[1], body=p[3], orelse=p[5])
+            p[0] = IfExp(test=p[3], body=p[1], orelse=p[5])
 
     def p_lambda_expr(self, p):
         p[0] = Lambda(args=arguments(args=p[2]), body=p[4])
@@ -425,17 +603,28 @@ class Parser(object):
     def p_parameter(self, p):
         p[0] = arg(arg=p[1])
 
+    # `a or b or c` is one BoolOp (and `a == b == c` one Compare) like
+    # ast.parse builds it. The left operand is extended only when it was
+    # reduced by this same production, which a parenthesized one is not.
     def p_or_test(self, p):
         if len(p) == 2:
             p[0] = p[1]
+        elif getattr(p.slice[1], 'chained', False):
+            p[0] = p[1]
+            p[0].values.append(p[3])
         else:
             p[0] = BoolOp(op=Or(), values=[p[1], p[3]])
+        p.slice[0].chained = len(p) == 4
 
     def p_and_test(self, p):
         if len(p) == 2:
             p[0] = p[1]
+        elif getattr(p.slice[1], 'chained', False):
+            p[0] = p[1]
+            p[0].values.append(p[3])
         else:
             p[0] = BoolOp(op=And(), values=[p[1], p[3]])
+        p.slice[0].chained = len(p) == 4
 
     def p_not_test(self, p):
         if len(p) == 2:
@@ -446,8 +635,13 @@ class Parser(object):
     def p_comparison(self, p):
         if len(p) == 2:
             p[0] = p[1]
+        elif getattr(p.slice[1], 'chained', False):
+            p[0] = p[1]
+            p[0].ops.append(p[2])
+            p[0].comparators.append(p[3])
         else:
             p[0] = Compare(left=p[1], ops=[p[2]], comparators=[p[3]])
+        p.slice[0].chained = len(p) == 4
 
     def p_comp_operator(self, p):
         p[0] = Eq() if p[1] == "==" else NotEq() if p[1] == "!=" else Is()
@@ -474,7 +668,7 @@ class Parser(object):
         p[0] = p[1]
 
     def p_return_stmt(self, p):
-        p[0] = Return(value=p[2])
+        p[0] = Return(value=expression_value(p[2]))
 
     def p_suite(self, p):
         if len(p) == 3:
@@ -497,75 +691,1119 @@ class Parser(object):
         err_tok = 'EOF'
         if p:
             err_tok = p
-        print(get_fileinfo(), '\033[1;31m Syntax error at "{}".\033[0m \n \033[1;31mParser State:{} {} . {}\033[0m'
-                .format(err_tok,
+        raise ValidationError('{} \033[1;31m Syntax error at "{}".\033[0m \n \033[1;31mParser State:{} {} . {}\033[0m'
+                .format(get_fileinfo(),
+                        err_tok,
                         self.parser.state,
                         stack_state_str,
                         p))
-        exit(1)
+
+    def subset_error(self, production):
+        raise ValidationError('{} \033[1;31m Syntax error: "{}" is not part of {}.\033[0m'
+                .format(get_fileinfo(),
+                        production,
+                        subset_tbl[self.level].upper()))
 
 
-def pparse(subset, codef):
-    """call ply parser"""
+class GrammarSpec(object):
+    """What ply reflects over to build the table: copies of the Parser
+    actions carrying the merged rules of grammar.py as docstrings, so
+    the Parser class itself is never modified."""
+    tokens = Parser.tokens
+    precedence = Parser.precedence
+
+    def __init__(self):
+        for func, doc in grammar + [('p_error', None)]:
+            action = getattr(Parser, func)
+            rule = types.FunctionType(action.__code__, action.__globals__,
+                                      func, action.__defaults__,
+                                      action.__closure__)
+            rule.__doc__ = doc
+            setattr(self, func, types.MethodType(rule, self))
+
+
+table = None
+table_lock = threading.Lock()
+
+
+def parse_table():
+    """Build the LALR table of the merged grammar once per process
+    (ply loads it from parsetab.py when the grammar is unchanged)."""
+    global table
+    with table_lock:
+        if table is None:
+            table = yacc.yacc(module=GrammarSpec())
+    return table
+
+
+def pparse(subset, codef, parser=None):
+    """call ply parser, reusing `parser` if one is given"""
     with open(codef.name, 'r') as f:
         code = f.read()
+    return parse_source(subset, code, parser)
+
+
+def tokenize(code, lexer=None):
+    """The token list the parser consumes for `code`. A Lexer may be
+    passed in to be reused; building one is costly."""
+    lexer = IndentWrapper(lexer or Lexer())
+    lexer.input(code)
+    return list(iter(lexer.token, None))
+
+
+class TokenReplay(object):
+    """Stands in for the lexer, handing out a token list from tokenize
+    so that one lexing pass can be parsed at several subsets."""
+
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+
+    def input(self, data):
+        pass
+
+    def token(self):
+        return next(self.tokens, None)
+
+
+def parse_source(subset, code, parser=None):
+    if isinstance(parser, IncrementalParser):
+        return parser.parse(code, subset)
     # Hack to get the Indentation working
     # Everyline must end with a newline
     code = code + '\n'
     lexer = Lexer()
     lexer = IndentWrapper(lexer)
-    parser = Parser(subset)
-    return parser.parse(code, lexer=lexer)
+    if parser is None:
+        parser = Parser(subset)
+    return parser.parse(code, lexer=lexer, subset=subset)
+
 
+# where a top-level statement starts: an unindented line that is not
+# blank, a comment, or an else/elif clause of the statement before it
+chunk_start = re.compile(r'^(?![\s#]|(?:else|elif)\b)', re.M)
 
-def exec_prog(file):
+
+def split_chunks(code):
+    """Split a module's source into top-level statements, at the lines
+    where IndentWrapper's NEWLINE returns to column 0. Blank and
+    comment lines stay with the statement before them; those before
+    the first statement go with it, so that a chunk is rejected where
+    the whole module would be (see Lexer.t_NEWLINE)."""
+    starts = [m.start() for m in chunk_start.finditer(code)]
+    if starts:
+        starts[0] = 0
+    else:
+        starts = [0]
+    bounds = starts + [len(code)]
+    return [code[a:b] for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+class IncrementalParser(object):
+    """Parses modules top-level statement by statement (split_chunks),
+    caching the tokens of every chunk by content hash and its
+    statements by hash and subset, so that reparsing an edited module
+    only lexes and parses the chunks that changed. Safe to share
+    between threads, each of which gets its own Parser and Lexer. The
+    returned Modules share the cached statements, which must not be
+    modified."""
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.tokens = OrderedDict()
+        self.bodies = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # chunks parsed and taken from the cache by the last parse,
+        # and by all parses
+        self.parsed = self.reused = 0
+        self.hits = self.misses = 0
+
+    def parser(self):
+        if not hasattr(self.local, 'parser'):
+            self.local.parser = Parser()
+        return self.local.parser
+
+    def lexer(self):
+        if not hasattr(self.local, 'lexer'):
+            self.local.lexer = Lexer()
+        return self.local.lexer
+
+    def lookup(self, cache, key):
+        with self.lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def remember(self, cache, key, value):
+        with self.lock:
+            cache[key] = value
+            if len(cache) > self.size:
+                cache.popitem(last=False)
+
+    def parse(self, code, subset='p3'):
+        subset = subset.lower()
+        body = []
+        parsed = reused = 0
+        for chunk in split_chunks(code):
+            key = hashlib.sha256(chunk.encode()).hexdigest()
+            stmts = self.lookup(self.bodies, (key, subset))
+            if stmts is None:
+                tokens = self.lookup(self.tokens, key)
+                if tokens is None:
+                    tokens = tokenize(chunk + '\n', self.lexer())
+                    self.remember(self.tokens, key, tokens)
+                stmts = self.parser().parse(chunk, TokenReplay(tokens),
+                                            subset).body
+                self.remember(self.bodies, (key, subset), stmts)
+                parsed += 1
+            else:
+                reused += 1
+            body.extend(stmts)
+        with self.lock:
+            self.parsed, self.reused = parsed, reused
+            self.hits += reused
+            self.misses += parsed
+        return Module(body=body)
+
+
+def exec_prog(file, usage=None):
     infilename = os.path.splitext(file)[0] + '.in'
     cmd = [python_exe, file]
+    try:
+        if os.path.isfile(infilename):
+            with open(infilename, 'r') as infile:
+                popen = RusagePopen(cmd,
+                                    stdin=infile,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, text=True)
+        else:
+            popen = RusagePopen(cmd,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, text=True)
+    except OSError as e:
+        return False, '{}: {}'.format(type(e).__name__, e), None
+    result = popen_result(popen, usage)
+    return result
+
+
+def read_input(file):
+    """Read the stdin of a program from its .in companion, if any."""
+    infilename = os.path.splitext(file)[0] + '.in'
     if os.path.isfile(infilename):
         with open(infilename, 'r') as infile:
-            popen = subprocess.Popen(cmd,
-                                     stdin=infile,
-                                     stdout=subprocess.PIPE)
+            return infile.read()
+    return None
+
+
+# code objects of the programs run in this process, by code_key
+code_cache = OrderedDict()
+code_cache_size = 1024
+
+
+def code_key(code):
+    """Content address of a program's code object: the source hash
+    plus the interpreter version and bytecode magic number."""
+    return '{}.{}.{}'.format(hashlib.sha256(code.encode()).hexdigest(),
+                             sys.implementation.cache_tag,
+                             importlib.util.MAGIC_NUMBER.hex())
+
+
+def load_code(code, cache_dir=None):
+    """Return the code object of a program, compiling it only if it is
+    neither in this process's cache nor marshalled in `cache_dir`."""
+    key = code_key(code)
+    obj = code_cache.get(key)
+    if obj is not None:
+        code_cache.move_to_end(key)
+        return obj
+    path = os.path.join(cache_dir, key) if cache_dir else None
+    if path and os.path.isfile(path):
+        with open(path, 'rb') as f:
+            obj = marshal.load(f)
+    else:
+        obj = compile(code, '<prog>', 'exec')
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp, 'wb') as f:
+                marshal.dump(obj, f)
+            os.replace(tmp, path)
+    code_cache[key] = obj
+    if len(code_cache) > code_cache_size:
+        code_cache.popitem(last=False)
+    return obj
+
+
+def run_prog(code, indata=None, cache_dir=None):
+    """Execute a program inside the current (pool worker) process with
+    `indata` as its stdin. Like popen_result, the run fails on an
+    uncaught exception or a non-zero exit status. The code object
+    comes from load_code, so reruns skip compilation.
+    Returns (ok, stdout, error)."""
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin = io.StringIO(indata or '')
+    sys.stdout = out = io.StringIO()
+    try:
+        exec(load_code(code, cache_dir), {'__name__': '__main__'})
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            return False, out.getvalue(), 'exit status {}'.format(e.code)
+    except BaseException:
+        return False, out.getvalue(), traceback.format_exc()
+    finally:
+        sys.stdin, sys.stdout = stdin, stdout
+    return True, out.getvalue(), None
+
+
+def run_python(code, indata=None, usage=None, interpreter=None, file=None):
+    """Run a program under python3, or the given `interpreter`: the
+    `file` on disk, or else `code` written to a temporary file (argv
+    cannot hold a long program). Returns (ok, stdout, error); a child
+    that cannot be started fails with the OSError as its error. The
+    child's resource usage is added to the `usage` dict."""
+    if file is None:
+        with tempfile.NamedTemporaryFile('w', suffix='.py') as f:
+            f.write(code)
+            f.flush()
+            return run_python(code, indata, usage, interpreter, f.name)
+    status, out, err = python_status(file, indata, usage, interpreter)
+    # like exec_prog, warnings on stderr do not fail the run
+    if status != 0 and not err:
+        err = 'exit status {}'.format(status)
+    return status == 0, out, err or None
+
+
+def python_status(file, indata=None, usage=None, interpreter=None):
+    """Run the program `file` like run_python. Returns (exit status,
+    stdout, stderr); the status is None, and stderr the OSError, if
+    the child cannot be started."""
+    try:
+        popen = RusagePopen([interpreter or python_exe, file],
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True)
+    except OSError as e:
+        return None, '', '{}: {}'.format(type(e).__name__, e)
+    out, err = popen.communicate(indata or '')
+    if usage is not None:
+        usage.update(popen.usage())
+    return popen.returncode, out, err
+
+
+def exec_python3(file, tree, usage=None, source=None):
+    """Run `file` under python3, or its `source` (code, stdin)
+    from a temporary file when the program is not on disk."""
+    if source is None:
+        return exec_prog(file, usage)
+    ok, out, err = run_python(*source, usage)
+    verboseprint(get_fileinfo(), out, err)
+    return ok, None if ok else err, out
+
+
+def exec_native(file, tree, usage=None, source=None):
+    """Run the ply tree of `file` in the built-in interpreter. Its
+    stdout is not python3's, so none is returned."""
+    indata = source[1] if source else read_input(file)
+    ok, out, err = interp.run(tree, indata)
+    verboseprint(get_fileinfo(), out, err)
+    return ok, err, None
+
+
+def exec_differential(file, tree, usage=None, source=None):
+    """Run `file` in the built-in interpreter and under python3
+    and check that both agree on its success and output."""
+    if source:
+        code, indata = source
+        python = run_python(code, indata, usage)
     else:
-        popen = subprocess.Popen(cmd,
-                                 stdin=subprocess.PIPE,
-                                 stdout=subprocess.PIPE)
-    result = popen_result(popen)
+        indata = read_input(file)
+        python = run_python(None, indata, usage, file=file)
+    native = interp.run(tree, indata)
+    verboseprint(get_fileinfo(), native, python)
+    if native[:2] != python[:2]:
+        return False, ("{}: interpreter differs from {}:\n"
+                       " interpreter: ok={} stdout={!r} error={!r}\n"
+                       " {}: ok={} stdout={!r} error={!r}"
+                       .format(file, python_exe, *native,
+                               python_exe, *python)), None
+    return native[0], native[2], python[1]
+
+
+# execution stage for each --executor, returning (ok, error, stdout of
+# python3 if it ran); the resource usage of a python3 child goes into
+# the `usage` dict, and programs that are not on disk come with their
+# `source`
+exec_tbl = {
+    'python3': exec_python3,
+    'native': exec_native,
+    'differential': exec_differential,
+}
+
+
+def validate_source(subset, code, parser=None, indata=None,
+                    execute=True, pool=None, native=False, cache_dir=None,
+                    lexer=None):
+    """Run the validation stages on a program held in memory, lexing
+    it with `lexer` if one is given.
+    Execution runs the parsed tree in the built-in interpreter if
+    `native`, else goes through `pool` (an executor running run_prog)
+    when one is given, otherwise through a python3 subprocess.
+    The pool keeps compiled programs in memory and in `cache_dir`.
+
+    Returns a verdict dict: `valid`, the failing `stage`
+    ('parse', 'nodes' or 'exec', None if valid), `error`,
+    the program's `stdout` and the time of each stage (`stages`)."""
+    verdict = {'valid': False, 'stage': None,
+               'error': None, 'stdout': None, 'stages': {}}
+    job = {'subset': subset, 'code': code, 'parser': parser,
+           'lexer': lexer, 'tree': None, 'error': None}
+    # cheapest first, as in stage_tbl
+    for stage in ('nodes', 'parse'):
+        start = time.perf_counter()
+        passed = stage_tbl[stage](job)
+        verdict['stages'][stage] = round(time.perf_counter() - start, 6)
+        if 'lex' in job:
+            verdict['lex'] = round(job.pop('lex'), 6)
+        if not passed:
+            verdict['stage'] = stage
+            verdict['error'] = job['error']
+            return verdict
+    tree = job['tree']
+    if execute:
+        verdict['stage'] = 'exec'
+        start = time.perf_counter()
+        if native:
+            ok, out, err = interp.run(tree, indata)
+        elif pool is not None:
+            ok, out, err = pool.submit(run_prog, code, indata,
+                                       cache_dir).result()
+        else:
+            ok, out, err = run_python(code, indata)
+        verdict['stages']['exec'] = round(time.perf_counter() - start, 6)
+        verdict['stdout'] = out
+        if not ok:
+            verdict['error'] = err
+            return verdict
+    verdict['valid'] = True
+    verdict['stage'] = None
+    return verdict
+
+
+def stage_nodes(job):
+    """Check the AST node types with ast.parse."""
+    try:
+        valid = dispatch_tbl[job['subset'].lower()](job['code'])
+    except SyntaxError as e:
+        job['error'] = 'SyntaxError: {}'.format(e)
+        return False
+    if not valid:
+        job['error'] = 'invalid AST node for {}'.format(job['subset'].upper())
+    return valid
+
+
+def stage_parse(job):
+    """Parse with the ply parser of the subset. With a plain Parser the
+    program is tokenized up front, with the job's `lexer` if it has
+    one, so the job's `lex` time can be told apart from the parse
+    proper."""
+    parser = job['parser']
+    try:
+        if isinstance(parser, Parser):
+            start = time.perf_counter()
+            tokens = tokenize(job['code'] + '\n', job.get('lexer'))
+            job['lex'] = time.perf_counter() - start
+            job['tree'] = parser.parse(job['code'], TokenReplay(tokens),
+                                       job['subset'])
+        else:
+            job['tree'] = parse_source(job['subset'], job['code'], parser)
+    except ValidationError as e:
+        job['error'] = str(e)
+        return False
+    return True
+
+
+def exec_interpreters(job):
+    """Run the program under all of `interpreters` at once: its file,
+    as exec_prog does, or its `source` from a temporary file. It fails
+    if it fails under any of them, or if its exit status or stdout
+    under one differs from that under the first. The verdict of each
+    interpreter goes into the job's `interpreters`: `ok`, its exit
+    `status`, whether it `diverged` from the first, the last line of
+    its `error` and its `wall` time. The resource usage and stdout
+    kept are those of the first."""
+    if job['source']:
+        code, indata = job['source']
+        with tempfile.NamedTemporaryFile('w', suffix='.py') as f:
+            f.write(code)
+            f.flush()
+            return run_interpreters(job, f.name, indata)
+    return run_interpreters(job, job['file'], read_input(job['file']))
+
+
+def run_interpreters(job, file, indata):
+    """exec_interpreters on the program `file`."""
+    usages = [{} for interpreter in interpreters]
+    with ThreadPoolExecutor(len(interpreters)) as pool:
+        runs = list(pool.map(python_status, [file] * len(interpreters),
+                             [indata] * len(interpreters), usages,
+                             interpreters))
+    job['usage'].update(usages[0])
+    job['stdout'] = runs[0][1]
+    job['interpreters'] = verdicts = OrderedDict()
+    errors = []
+    for interpreter, (status, out, err), usage in zip(interpreters, runs,
+                                                      usages):
+        ok = status == 0
+        diverged = (status, out) != runs[0][:2]
+        lines = err.strip().splitlines() if err else []
+        error = None
+        if not ok:
+            error = lines[-1] if lines else 'exit status {}'.format(status)
+        verdicts[interpreter] = {
+            'ok': ok, 'status': status, 'diverged': diverged,
+            'error': error, 'wall': usage.get('wall')}
+        if diverged:
+            errors.append('{} differs from {}:\n'
+                          ' {}: status={} stdout={!r}\n'
+                          ' {}: status={} stdout={!r}'
+                          .format(interpreter, interpreters[0],
+                                  interpreters[0], *runs[0][:2],
+                                  interpreter, status, out))
+    if not errors and runs[0][0] != 0:
+        errors.append(runs[0][2].strip() or
+                      'exit status {}'.format(runs[0][0]))
+    verboseprint(get_fileinfo(), runs)
+    job['error'] = '\n'.join(errors) or None
+    return not errors
+
+
+def stage_exec(job):
+    """Run the program with the job's executor. The in-process executors
+    take the ply tree, or the ast.parse one when parse is not a stage.
+    With --interpreters, python3 is exec_interpreters."""
+    if job['executor'] == 'python3' and interpreters:
+        return exec_interpreters(job)
+    tree = job['tree']
+    if tree is None and job['executor'] != 'python3':
+        try:
+            tree = ast.parse(job['code'])
+        except SyntaxError as e:
+            job['error'] = 'SyntaxError: {}'.format(e)
+            return False
+    ok, error, job['stdout'] = exec_tbl[job['executor']](
+        job['file'], tree, job['usage'], job['source'])
+    if not ok:
+        job['error'] = error
+    return ok
+
+
+# validation stages, cheapest first
+stage_tbl = OrderedDict([
+    ('nodes', stage_nodes),
+    ('parse', stage_parse),
+    ('exec', stage_exec),
+])
+default_stages = list(stage_tbl)
+
+
+def run_stage(stage, job, result, profile=False, memprofile=False):
+    """Run one stage of validate_file, under cProfile and tracemalloc
+    if asked to. Returns whether the stage passed."""
+    if memprofile:
+        lines = max(job['code'].count('\n'), 1)
+        passed, memory = memprofile_call(run_stage, stage, job, result,
+                                         profile, lines=lines)
+        result.setdefault('memory', {})[stage] = memory
+    elif profile:
+        passed, stats = profile_call(stage_tbl[stage], job)
+        result.setdefault('profile', {})[stage] = stats
+    else:
+        passed = stage_tbl[stage](job)
+    return passed
+
+
+def validate_file(subset, file, parser, executor='python3',
+                  stages=default_stages, source=None, profile=False,
+                  memprofile=False, code=None):
+    """Run `stages` on `file` in order, stopping at the first that
+    fails. A program that is not on disk (see archive.py) is
+    given as its `source`, a (code, stdin) pair. The `code` of a file
+    on disk may be given when it has been read already; the file
+    still runs from its path. The time spent
+    lexing, part of the parse stage, is kept as `lex`. With `profile`,
+    every stage runs under cProfile and the raw stats are kept
+    in the result's `profile` (see profiling.aggregate). With
+    `memprofile`, the tracemalloc figures of every stage go into
+    the result's `memory`. Returns a report result: `file`, `valid`, the failing
+    `stage`, `error`, the total `time`, the time of each stage run
+    (`stages`) and the resource usage of the executed child process,
+    if any (`rusage`)."""
+    result = {'file': file, 'valid': False, 'stage': None,
+              'error': None, 'time': None, 'stages': {}}
+    if source is not None:
+        code = source[0]
+    elif code is None:
+        with open(file, 'r') as f:
+            code = f.read()
+    job = {'subset': subset, 'file': file, 'code': code, 'parser': parser,
+           'executor': executor, 'source': source, 'tree': None,
+           'usage': {}, 'error': None}
+    for stage in stages:
+        start = time.perf_counter()
+        passed = run_stage(stage, job, result, profile, memprofile)
+        result['stages'][stage] = round(time.perf_counter() - start, 6)
+        if not passed:
+            result['stage'] = stage
+            result['error'] = job['error']
+            break
+    else:
+        result['valid'] = True
+    if 'lex' in job:
+        result['lex'] = round(job['lex'], 6)
+    if job['usage']:
+        result['rusage'] = job['usage']
+    if 'interpreters' in job:
+        result['interpreters'] = job['interpreters']
+    if job.get('stdout') is not None:
+        # python3's stdout, for compile_results; not kept in reports
+        result['stdout'] = job['stdout']
+    result['time'] = round(sum(result['stages'].values()), 6)
     return result
 
 
+# --subset value that checks a program against every subset
+all_subsets = 'all'
+
+
+def subset_nodes(subset):
+    """The AST node types allowed in `subset`."""
+    level = subset_tbl.index(subset.lower())
+    return {node for group in nodes[:level + 1] for node in group}
+
+
+def subset_parser(subset):
+    """A Parser for `subset`; the largest subset's for all_subsets."""
+    if subset.lower() == all_subsets:
+        subset = subset_tbl[-1]
+    return Parser(subset)
+
+
+def validate_matrix(file, parser, executor='python3',
+                    stages=default_stages, source=None, code=None):
+    """Validate `file` against every subset at once: lex once and replay
+    the tokens through the parser at each subset, check the nodes of
+    one ast.parse tree, and execute at most once. Returns a report
+    result like validate_file's, with `subsets` mapping each subset to
+    its `valid`, failing `stage` and `error`. The file is `valid` when
+    it is valid for some subset; otherwise `stage` and `error` are
+    those of the largest subset."""
+    result = {'file': file, 'valid': False, 'stage': None,
+              'error': None, 'time': None, 'stages': {}}
+    if source is not None:
+        code = source[0]
+    elif code is None:
+        with open(file, 'r') as f:
+            code = f.read()
+    job = {'subset': subset_tbl[-1], 'file': file, 'code': code,
+           'parser': parser, 'executor': executor, 'source': source,
+           'tree': None, 'usage': {}, 'error': None}
+    verdicts = OrderedDict((subset, {'valid': True, 'stage': None,
+                                     'error': None})
+                           for subset in subset_tbl)
+
+    def fail(stage, error, subsets=subset_tbl):
+        for subset in subsets:
+            if verdicts[subset]['valid']:
+                verdicts[subset].update(valid=False, stage=stage,
+                                        error=error)
+
+    for stage in stages:
+        passing = [s for s in subset_tbl if verdicts[s]['valid']]
+        if not passing:
+            break
+        start = time.perf_counter()
+        if stage == 'nodes':
+            try:
+                found = {type(node) for node in ast.walk(ast.parse(code))}
+            except SyntaxError as e:
+                fail(stage, 'SyntaxError: {}'.format(e))
+            else:
+                for subset in passing:
+                    if not found <= subset_nodes(subset):
+                        fail(stage, 'invalid AST node for {}'.format(
+                            subset.upper()), [subset])
+        elif stage == 'parse':
+            try:
+                tokens = tokenize(code + '\n')
+                result['lex'] = round(time.perf_counter() - start, 6)
+            except ValidationError as e:
+                fail(stage, str(e))
+            else:
+                for subset in passing:
+                    try:
+                        job['tree'] = parser.parse(code, TokenReplay(tokens),
+                                                   subset)
+                    except ValidationError as e:
+                        fail(stage, str(e), [subset])
+        elif not stage_tbl[stage](job):
+            fail(stage, job['error'])
+        result['stages'][stage] = round(time.perf_counter() - start, 6)
+    result['subsets'] = verdicts
+    result['valid'] = any(v['valid'] for v in verdicts.values())
+    if not result['valid']:
+        result['stage'] = verdicts[subset_tbl[-1]]['stage']
+        result['error'] = verdicts[subset_tbl[-1]]['error']
+    if job['usage']:
+        result['rusage'] = job['usage']
+    if 'interpreters' in job:
+        result['interpreters'] = job['interpreters']
+    if job.get('stdout') is not None:
+        # python3's stdout, for compile_results; not kept in reports
+        result['stdout'] = job['stdout']
+    result['time'] = round(sum(result['stages'].values()), 6)
+    return result
+
+
+def validate_any(subset, file, parser, executor='python3',
+                 stages=default_stages, source=None, profile=False,
+                 memprofile=False, code=None):
+    """validate_file, or validate_matrix (which is not
+    profiled) for all_subsets. A file the validator itself fails on
+    fails at the 'internal' stage, so it cannot end the run."""
+    try:
+        if subset.lower() == all_subsets:
+            return validate_matrix(file, parser, executor, stages, source,
+                                   code)
+        return validate_file(subset, file, parser, executor, stages,
+                             source, profile, memprofile, code)
+    except Exception as e:
+        return {'file': file, 'valid': False, 'stage': 'internal',
+                'error': '{}: {}'.format(type(e).__name__, e),
+                'time': 0.0, 'stages': {}}
+
+
+# the parser and shared corpus of a pool worker process, see init_worker
+worker_parser = None
+worker_corpus = None
+
+
+def init_worker(subset, verbose, corpus=None, groups=None,
+                interpreter_list=None):
+    global worker_parser, worker_corpus, verboseprint, interpreters
+    verboseprint = print if verbose else lambda *a, **k: None
+    interpreters = interpreter_list
+    if groups is not None:
+        # a process group of its own, which the children it runs
+        # join, so that a cancelled run can kill them all at once;
+        # its id goes to the parent through the `groups` queue
+        os.setpgrp()
+        groups.put(os.getpid())
+    worker_parser = subset_parser(subset)
+    if corpus is not None:
+        worker_corpus = SharedCorpus.attach(corpus)
+
+
+def validate_in_worker(subset, file, executor, stages, source, entry=None,
+                       profile=False, memprofile=False, on_disk=False):
+    """validate_any in a pool worker. A program taken from the shared
+    corpus by its `entry` is lexed and parsed from there; one that is
+    `on_disk` still runs from its path, as without a shared corpus."""
+    code = None
+    if entry is not None:
+        source = worker_corpus.source(entry)
+        if on_disk:
+            code, source = source[0], None
+    return validate_any(subset, file, worker_parser, executor, stages,
+                        source, profile, memprofile, code)
+
+
+def run_files(subset, files, executor='python3', jobs=1,
+              stages=default_stages, archive=None, shared=False,
+              profile_rate=None, memprofile=False, fail_fast=False):
+    """Validate `files`, yielding their results as they complete.
+    With more than one job a pool of worker processes takes the
+    files in the given order. Files are read from `archive`
+    when one is given. With `shared`, the files and their stdin are
+    packed into a SharedCorpus first and the workers read them
+    from shared memory. With a `profile_rate`, that fraction of the
+    files is profiled (see profiling.sampled); with `memprofile`,
+    the memory of every file is. With `fail_fast`, closing the
+    generator early kills the workers and the programs they run
+    instead of waiting for them."""
+    def source(file):
+        return archive.source(file) if archive else None
+
+    def profile(file):
+        return profile_rate is not None and sampled(file, profile_rate)
+
+    def read(file):
+        if archive:
+            return archive.source(file)
+        with open(file, 'r') as f:
+            return f.read(), read_input(file)
+
+    if jobs <= 1:
+        parser = subset_parser(subset)
+        for file in files:
+            verboseprint(get_fileinfo(), '\033[1;32m Validating {}\033[0m'.format(file))
+            yield validate_any(subset, file, parser, executor, stages,
+                               source(file), profile(file), memprofile)
+        return
+    corpus = None
+    if shared:
+        corpus = SharedCorpus.create((file, *read(file)) for file in files)
+    # the process groups of the workers, for fail_fast to kill
+    groups = multiprocessing.SimpleQueue() if fail_fast else None
+    pool = ProcessPoolExecutor(jobs, initializer=init_worker,
+                               initargs=(subset, verboseprint is print,
+                                         corpus and corpus.name, groups,
+                                         interpreters))
+    try:
+        if corpus:
+            futures = [pool.submit(validate_in_worker, subset, file,
+                                   executor, stages, None,
+                                   corpus.index[file], profile(file),
+                                   memprofile, archive is None)
+                       for file in files]
+        else:
+            futures = [pool.submit(validate_in_worker, subset, file,
+                                   executor, stages, source(file),
+                                   None, profile(file), memprofile)
+                       for file in files]
+        for future in as_completed(futures):
+            yield future.result()
+    except GeneratorExit:
+        while groups is not None and not groups.empty():
+            try:
+                os.killpg(groups.get(), signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        raise
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if corpus:
+            corpus.close()
+
+
+def compile_results(results, pipeline, archive=None):
+    """Pass validation results through, sending every valid program
+    down the compiler Pipeline. Those come out once compiled, built
+    and run, with the pipeline's verdict as `compiler`; a program the
+    compiled code gets wrong is invalid, failing at the compile, build
+    or run stage. The compiled run is compared with python3's stdout
+    from the exec stage; only without one does the pipeline run
+    python3 again."""
+    pending = {}
+
+    def finished(future):
+        result = pending.pop(future)
+        verdict = future.result()
+        result['compiler'] = verdict
+        if not verdict['valid']:
+            result.update(valid=False, stage=verdict['stage'],
+                          error=verdict['error'])
+        return result
+
+    for result in results:
+        if not result['valid']:
+            yield result
+        else:
+            file = result['file']
+            if archive:
+                code, indata = archive.source(file)
+            else:
+                with open(file, 'r') as f:
+                    code = f.read()
+                indata = read_input(file)
+            expected = None
+            if result.get('stdout') is not None:
+                expected = (True, result['stdout'], None)
+            future = pipeline.submit(file, code, indata,
+                                     on_disk=archive is None,
+                                     expected=expected)
+            pending[future] = result
+        for future in [future for future in pending if future.done()]:
+            yield finished(future)
+    for future in as_completed(list(pending)):
+        yield finished(future)
+
+
+def discover(path):
+    """The programs to validate: `path` itself or the .py files
+    in it, in sorted order so every runner sees the same list."""
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, file)
+                      for file in os.listdir(path) if file.endswith('.py'))
+    return [path]
+
+
+def read_source(file):
+    """(code, stdin) of a program on disk."""
+    with open(file, 'r') as f:
+        return f.read(), read_input(file)
+
+
+def open_programs(path):
+    """The programs under `path`, a file, a directory or an archive,
+    and the function that reads the (code, stdin) of each."""
+    if is_archive(path):
+        archive = Archive(path)
+        return archive.programs(), archive.source
+    return discover(path), read_source
+
+
+def shard_files(files, index, count, durations=None):
+    """The files of shard `index` (1-based) out of `count`. Without
+    durations files are dealt round-robin; with them, longest first to
+    the shard with the least expected runtime so far. Files without a
+    recorded duration are expected to take the mean. Deterministic
+    for the same files and durations."""
+    if not durations:
+        return files[index - 1::count]
+    known = [durations[file] for file in files if file in durations]
+    default = sum(known) / len(known) if known else 0.0
+    expected = {file: durations.get(file, default) for file in files}
+    loads = [0.0] * count
+    shards = [[] for _ in range(count)]
+    for file in sorted(files, key=lambda file: (-expected[file], file)):
+        shard = loads.index(min(loads))
+        shards[shard].append(file)
+        loads[shard] += expected[file]
+    return sorted(shards[index - 1])
+
+
+def shard_spec(value):
+    """Parse --shard i/N."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected i/N, got {}".format(value))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            "shard index must be between 1 and {}".format(count))
+    return index, count
+
+
+def stages_spec(value):
+    """Parse --stages, a comma-separated list of stage_tbl names."""
+    stages = [stage.strip() for stage in value.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in stage_tbl]
+    if unknown or not stages or len(set(stages)) != len(stages):
+        raise argparse.ArgumentTypeError(
+            "expected distinct stages out of {}, got {}".format(
+                ','.join(stage_tbl), value))
+    return stages
+
+
+def interpreters_spec(value):
+    """Parse --interpreters, a comma-separated list of interpreters
+    (paths, or names looked up on PATH)."""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    missing = [name for name in names if shutil.which(name) is None]
+    if missing or not names or len(set(names)) != len(names):
+        raise argparse.ArgumentTypeError(
+            "expected distinct interpreters, got {}{}".format(
+                value, '; not found: {}'.format(', '.join(missing))
+                if missing else ''))
+    return names
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Validate python subset")
     parser.add_argument(
-        "--subset", help="python subset to validate", required=True)
+        "--subset", help="python subset to validate, or 'all' for a"
+        " matrix of the subsets each file is valid for", required=True)
     parser.add_argument(
-        "--input", help="input file(s) to validate", required=True)
+        "--input", help="input file(s) to validate: a file, a directory"
+        " or a tar/zip archive", required=True)
     parser.add_argument(
         "--verbose", help="print verbose output", action="store_true")
+    parser.add_argument(
+        "--executor", help="how to run the programs: under python3, in the"
+        " built-in interpreter (native) or both, comparing their output"
+        " (differential)", choices=sorted(exec_tbl), default='python3')
+    parser.add_argument(
+        "--interpreters", help="comma-separated python interpreters to"
+        " run every program under at once, instead of python3; output or"
+        " success differing from the first one's fails the program",
+        type=interpreters_spec)
+    parser.add_argument(
+        "--shard", help="validate only shard i of N (1-based) of the files",
+        type=shard_spec)
+    parser.add_argument(
+        "--durations", help="report of an earlier run, used to balance"
+        " the shards by expected runtime")
+    parser.add_argument(
+        "--report", help="validate every file and write a JSON report"
+        " (a partial report when sharded, see report.py merge)")
+    parser.add_argument(
+        "--stages", help="comma-separated stages to run, in order, stopping"
+        " at the first failure (default: {}, cheapest first)".format(
+            ','.join(default_stages)),
+        type=stages_spec, default=default_stages)
+    parser.add_argument(
+        "--parse-only", help="only parse (same as --stages=parse)",
+        dest="stages", action="store_const", const=['parse'])
+    parser.add_argument(
+        "--no-exec", help="check but do not run the programs"
+        " (same as --stages=nodes,parse)",
+        dest="stages", action="store_const", const=['nodes', 'parse'])
+    parser.add_argument(
+        "--jobs", help="number of files to validate in parallel",
+        type=int, default=1)
+    parser.add_argument(
+        "--shared-corpus", help="with --jobs, pack the programs into"
+        " shared memory for the workers instead of having each worker"
+        " read its files", action="store_true")
+    parser.add_argument(
+        "--fail-fast", help="stop at the first invalid file, cancelling"
+        " the files still queued and killing the programs running",
+        action="store_true")
+    parser.add_argument(
+        "--cprofile", help="profile every stage with cProfile and write"
+        " <prefix>.<stage>.pstats and <prefix>.<stage>.collapsed"
+        " (collapsed stacks for flamegraph tools)", metavar="PREFIX")
+    parser.add_argument(
+        "--profile-rate", help="fraction of the files to profile",
+        type=float, default=1.0)
+    parser.add_argument(
+        "--memprofile", help="record the peak and retained memory of"
+        " every stage and the top allocation sites (tracemalloc) in the"
+        " report", action="store_true")
+    parser.add_argument(
+        "--metrics", help="keep an OpenMetrics textfile of counters and"
+        " stage latency histograms up to date, for the node-exporter"
+        " textfile collector", metavar="PATH")
+    parser.add_argument(
+        "--compiler-cmd", help="compile every valid program with this"
+        " command and check the compiled program's output against"
+        " python3 (placeholders: {src} {asm} {exe} {dir})")
+    parser.add_argument(
+        "--build-cmd", help="build the compiler output into {exe}")
+    parser.add_argument(
+        "--run-cmd", help="run the built program", default="{exe}")
+    parser.add_argument(
+        "--compiler-timeout", help="seconds each compile, build and run"
+        " may take", type=float, default=60)
+    parser.add_argument(
+        "--history", help="SQLite database of the stage durations of"
+        " earlier runs; this run is recorded in it, files are scheduled"
+        " longest first and runtime regressions are flagged")
+    parser.add_argument(
+        "--regression-threshold", help="flag files taking more than this"
+        " many times their historical runtime", type=float, default=1.5)
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    global verboseprint
+    global verboseprint, interpreters
     verboseprint = print if args.verbose else lambda *a, **k: None
-    prog_files = []
-    if is_valid_subset(args.subset):
-        if os.path.isdir(args.input):
-            # run validation on all files in the directory
-            for file in os.listdir(args.input):
-                if file.endswith('.py'):
-                    prog_files.append(os.path.join(args.input, file))
+    if args.interpreters and args.executor != 'python3':
+        print('--interpreters runs programs in place of python3; '
+              'it cannot be used with --executor={}'.format(args.executor))
+        exit(1)
+    interpreters = args.interpreters
+    matrix = args.subset.lower() == all_subsets
+    if matrix or is_valid_subset(args.subset):
+        archive = None
+        if is_archive(args.input):
+            archive = Archive(args.input)
+            prog_files = archive.programs()
         else:
-            prog_files.append(args.input)
-
-        for file in prog_files:
-            with open(file, 'r') as f:
-                verboseprint(get_fileinfo(), '\033[1;32m Validating {}\033[0m'.format(file))
-                assert pparse(args.subset, f) \
-                    and traverse(args.subset, f) \
-                    and exec_prog(file) == True, \
-                    "invalid program: {}".format(file)
+            prog_files = discover(args.input)
+        hist = History(args.history) if args.history else None
+        expected = hist.expected(args.subset, prog_files,
+                                 args.stages) if hist else {}
+        if args.shard:
+            # only a report every runner shares may balance the shards;
+            # a local --history differs between machines, and so would
+            # the shards they compute
+            durations = None
+            if args.durations:
+                durations = report.durations(report.load_report(args.durations))
+            prog_files = shard_files(prog_files, *args.shard, durations)
+
+        # longest first, so that no slow file is started last
+        order = longest_first(prog_files, expected)
+        metrics = Metrics(args.metrics) if args.metrics else None
+        results = []
+        runs = validated = run_files(
+            args.subset, order, args.executor, args.jobs, args.stages,
+            archive, args.shared_corpus,
+            args.profile_rate if args.cprofile else None,
+            args.memprofile, args.fail_fast)
+        pipeline = None
+        if args.compiler_cmd:
+            pipeline = Pipeline(Toolchain(args.compiler_cmd, args.build_cmd,
+                                          args.run_cmd,
+                                          args.compiler_timeout),
+                                run_python)
+            validated = compile_results(validated, pipeline, archive)
+        try:
+            for result in validated:
+                if expected:
+                    result['regressed'] = regressed(
+                        result, expected, args.regression_threshold)
+                    if result['regressed']:
+                        print('{}: took {:.3f}s, expected {:.3f}s'.format(
+                            result['file'], result['time'],
+                            expected[result['file']]))
+                result.pop('stdout', None)
+                results.append(result)
+                if metrics:
+                    metrics.record(args.subset, result)
+                    metrics.update()
+                if args.fail_fast and not result['valid']:
+                    if result['error'] and not args.report:
+                        print(result['error'])
+                    print('{}: failed at the {} stage, stopping'.format(
+                        result['file'], result['stage']))
+                    break
+                if args.report or matrix:
+                    continue
+                if result['stage'] == 'parse':
+                    print(result['error'])
+                    exit(1)
+                if result['error']:
+                    print(result['error'])
+                assert result['valid'], "invalid program: {}".format(
+                    result['file'])
+        finally:
+            if pipeline:
+                pipeline.close(cancel=args.fail_fast)
+            runs.close()
+        # without a result: cancelled, killed while running, or
+        # finished after the run stopped
+        done = {result['file'] for result in results}
+        skipped = [file for file in order if file not in done]
+        if archive:
+            archive.close()
+        if metrics:
+            metrics.write()
+        if args.cprofile:
+            for path in write_profiles(args.cprofile, aggregate(results)):
+                verboseprint(get_fileinfo(), 'wrote {}'.format(path))
+        if hist:
+            hist.record(args.subset, results)
+            hist.close()
+        results.sort(key=lambda result: result['file'])
+        if matrix and not args.report:
+            width = max([len(result['file']) for result in results] + [4])
+            print('{:{}}  {}'.format('file', width, '  '.join(
+                '{:5}'.format(subset.upper()) for subset in subset_tbl))
+                .rstrip())
+            for result in results:
+                print('{:{}}  {}'.format(result['file'], width, '  '.join(
+                    '{:5}'.format('ok' if v['valid'] else v['stage'])
+                    for v in result['subsets'].values())).rstrip())
+        if args.report:
+            report.write_report(args.report, report.make_report(
+                args.subset, results, args.shard, skipped))
+        if args.report or matrix or args.fail_fast:
+            exit(0 if all(result['valid'] for result in results) else 1)
 
 
 if __name__ == "__main__":